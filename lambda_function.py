@@ -1,147 +1,1571 @@
 # region Imports
+import time
+start = time.time()
 import os
 import io
 import json
-import time
 import uuid
-import boto3
 import base64
+import wave
+import re
+import random
+import hashlib
 import logging
-import pinecone
+import tempfile
+import cProfile
+import pstats
+import resource
+import functools
+import tracemalloc
 import requests
+import threading
 import urllib.parse
-from botocore.config import Config
-from datetime import datetime
-from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
 # endregion 
 
 # region Initialization
 # Initialization Related
-config = Config(
-    read_timeout=900,
-    connect_timeout=900,
-    retries={"max_attempts": 0},
-    tcp_keepalive=True,
-)
-start = time.time()
-session = boto3.Session()
-s3 = session.client('s3')
-lam = session.client('lambda', config=config)
-
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # General Related
 AUDIO_CLEANING_LAMBDA_NAME = os.environ.get('AUDIO_CLEANING_LAMBDA_NAME')
+AUDIO_CLEANING_BACKEND = os.environ.get('AUDIO_CLEANING_BACKEND', 'local')
+MAX_RECORD_WORKERS = int(os.environ.get('MAX_RECORD_WORKERS', '4'))
+AUDIO_TRANSFER_MODE = os.environ.get('AUDIO_TRANSFER_MODE', 'stream')
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', str(1024 * 1024)))
 
 # OpenAI Related
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL')
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-embeddings_model = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL, dimensions=1536)
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '1536'))
 
 # Deepgram Related
 DEEPGRAM_API_KEY = os.environ.get('DEEPGRAM_API_KEY')
+DEEPGRAM_API_URL = os.environ.get('DEEPGRAM_API_URL', 'https://api.deepgram.com/v1/listen')
+DEEPGRAM_PARAMS = {
+    'model': 'nova-2-general',
+    'version': 'latest',
+    # 'detect_language': 'true',
+    'language': 'en',
+    'diarize': 'true',
+    'smart_format': 'true',
+    'filler_words': 'true'
+}
 CLEAN_MODEL = str(os.environ.get('CLEAN_MODEL'))
 
 # Together Related
 TOGETHER_API_KEY = str(os.environ.get('TOGETHER_API_KEY'))
+TOGETHER_API_URL = os.environ.get('TOGETHER_API_URL', 'https://api.together.xyz/v1/chat/completions')
+
+# Cleaning Related
+CLEAN_WINDOW_TOKENS = int(os.environ.get('CLEAN_WINDOW_TOKENS', '1500'))
+CLEAN_MAX_OUTPUT_TOKENS = int(os.environ.get('CLEAN_MAX_OUTPUT_TOKENS', '4096'))
+CLEAN_CHARS_PER_TOKEN = float(os.environ.get('CLEAN_CHARS_PER_TOKEN', '4'))
+CLEAN_MIN_WORDS = int(os.environ.get('CLEAN_MIN_WORDS', '3'))
+CLEAN_MAX_WORKERS = int(os.environ.get('CLEAN_MAX_WORKERS', '4'))
+
+# Chunked Transcription Related
+CHUNKED_TRANSCRIPTION = os.environ.get('CHUNKED_TRANSCRIPTION', 'false') == 'true'
+TRANSCRIPTION_SEGMENT_SECONDS = float(os.environ.get('TRANSCRIPTION_SEGMENT_SECONDS', '300'))
+TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS = float(os.environ.get('TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS', '2'))
+TRANSCRIPTION_SILENCE_SEARCH_SECONDS = float(os.environ.get('TRANSCRIPTION_SILENCE_SEARCH_SECONDS', '10'))
+TRANSCRIPTION_MAX_WORKERS = int(os.environ.get('TRANSCRIPTION_MAX_WORKERS', '4'))
+
+# Upload Related
+STT_DOWNMIX_RESAMPLE = os.environ.get('STT_DOWNMIX_RESAMPLE', 'true') == 'true'
+STT_TARGET_SAMPLE_RATE = int(os.environ.get('STT_TARGET_SAMPLE_RATE', '16000'))
+STT_RESAMPLE_TAPS = int(os.environ.get('STT_RESAMPLE_TAPS', '63'))
+AUDIO_DECODE_MAX_BYTES = int(os.environ.get('AUDIO_DECODE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Voice Activity Related
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'true') == 'true'
+VAD_ENERGY_THRESHOLD_DB = float(os.environ.get('VAD_ENERGY_THRESHOLD_DB', '-45'))
+VAD_NOISE_MARGIN_DB = float(os.environ.get('VAD_NOISE_MARGIN_DB', '6'))
+VAD_MIN_SPEECH_SECONDS = float(os.environ.get('VAD_MIN_SPEECH_SECONDS', '0.3'))
+
+# Audio Cleaning Related
+AUDIO_TARGET_LOUDNESS_DB = float(os.environ.get('AUDIO_TARGET_LOUDNESS_DB', '-20'))
+AUDIO_SILENCE_PADDING_SECONDS = float(os.environ.get('AUDIO_SILENCE_PADDING_SECONDS', '0.2'))
+AUDIO_MUSIC_SUPPRESSION = float(os.environ.get('AUDIO_MUSIC_SUPPRESSION', '1.5'))
+AUDIO_MUSIC_MIN_GAIN = float(os.environ.get('AUDIO_MUSIC_MIN_GAIN', '0.1'))
+AUDIO_STFT_SIZE = int(os.environ.get('AUDIO_STFT_SIZE', '1024'))
 
 # HuggingFace Related
 HUGGINGFACE_API_KEY = str(os.environ.get('HUGGINGFACE_API_KEY'))
+HUGGINGFACE_API_URL = os.environ.get('HUGGINGFACE_API_URL', 'https://api-inference.huggingface.co/models/openai/whisper-large-v3')
 
 # Pinecone Related
 PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
 PINECONE_ENV_KEY = os.environ.get('PINECONE_ENV_KEY')
 PINECONE_INDEX_NAME = os.environ.get('PINECONE_INDEX_NAME')
-pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENV_KEY)
-index = pinecone.Index(PINECONE_INDEX_NAME)
 
 # System Prompts
 CLEAN_SYSTEM_PROMPT = str(os.environ.get('CLEAN_SYSTEM_PROMPT'))
 SPEAKER_LABEL_SYSTEM_PROMPT = str(os.environ.get('SPEAKER_LABEL_SYSTEM_PROMPT'))
+WHISPER_PROMPT = str(os.environ.get('WHISPER_PROMPT', ''))
+
+# Backend Related
+STT_BACKENDS = [name.strip() for name in os.environ.get('STT_BACKENDS', 'deepgram').split(',') if name.strip()]
+LLM_BACKENDS = [name.strip() for name in os.environ.get('LLM_BACKENDS', 'together').split(',') if name.strip()]
+GPT_MODEL = os.environ.get('GPT_MODEL', 'gpt-3.5-turbo')
+BACKEND_WINDOW = int(os.environ.get('BACKEND_WINDOW', '50'))
+BACKEND_MIN_SAMPLES = int(os.environ.get('BACKEND_MIN_SAMPLES', '5'))
+BACKEND_MAX_ERROR_RATE = float(os.environ.get('BACKEND_MAX_ERROR_RATE', '0.5'))
+BACKEND_HEDGING = os.environ.get('BACKEND_HEDGING', 'false') == 'true'
+BACKEND_HEDGE_WORKERS = int(os.environ.get('BACKEND_HEDGE_WORKERS', '8'))
+
+# HTTP Related
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '300'))
+HTTP_TOTAL_TIMEOUT = float(os.environ.get('HTTP_TOTAL_TIMEOUT', '600'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', '0.5'))
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', '8'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Vendor Limit Related
+VENDOR_INITIAL_CONCURRENCY = float(os.environ.get('VENDOR_INITIAL_CONCURRENCY', '4'))
+VENDOR_MIN_CONCURRENCY = float(os.environ.get('VENDOR_MIN_CONCURRENCY', '1'))
+VENDOR_MAX_CONCURRENCY = float(os.environ.get('VENDOR_MAX_CONCURRENCY', '32'))
+VENDOR_RATE_PER_SECOND = float(os.environ.get('VENDOR_RATE_PER_SECOND', '20'))
+VENDOR_DECREASE_COOLDOWN = float(os.environ.get('VENDOR_DECREASE_COOLDOWN', '1'))
+VENDOR_LIMITS = json.loads(os.environ.get('VENDOR_LIMITS', '{}'))
+
+# Result Cache Related
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true') == 'true'
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_BUCKET = os.environ.get('RESULT_CACHE_BUCKET')
+RESULT_CACHE_PREFIX = os.environ.get('RESULT_CACHE_PREFIX', 'cache/')
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+
+# Ledger Related
+LEDGER_TABLE_NAME = os.environ.get('LEDGER_TABLE_NAME')
+LEDGER_DIR = os.environ.get('LEDGER_DIR')
+LEDGER_CLAIM_TTL = int(os.environ.get('LEDGER_CLAIM_TTL', '900'))
+LEDGER_MEMORY_SIZE = int(os.environ.get('LEDGER_MEMORY_SIZE', '10000'))
+VECTOR_ID_NAMESPACE = uuid.UUID(os.environ.get('VECTOR_ID_NAMESPACE', '6f1f3d2e-5a8b-4c1d-9e7f-0a2b3c4d5e6f'))
+
+# Vector Buffer Related
+VECTOR_BUFFER_ENABLED = os.environ.get('VECTOR_BUFFER_ENABLED', 'true') == 'true'
+VECTOR_BUFFER_SIZE = int(os.environ.get('VECTOR_BUFFER_SIZE', '32'))
+VECTOR_BUFFER_MAX_AGE = float(os.environ.get('VECTOR_BUFFER_MAX_AGE', '0.5'))
+PINECONE_UPSERT_BATCH_SIZE = int(os.environ.get('PINECONE_UPSERT_BATCH_SIZE', '100'))
+
+# Backfill Related
+BACKFILL_MAX_WORKERS = int(os.environ.get('BACKFILL_MAX_WORKERS', '8'))
+BACKFILL_EMBED_BATCH_SIZE = int(os.environ.get('BACKFILL_EMBED_BATCH_SIZE', '512'))
+BACKFILL_QUERY_TOP_K = int(os.environ.get('BACKFILL_QUERY_TOP_K', '10000'))
+BACKFILL_FETCH_BATCH_SIZE = int(os.environ.get('BACKFILL_FETCH_BATCH_SIZE', '1000'))
+BACKFILL_PAGE_SIZE = int(os.environ.get('BACKFILL_PAGE_SIZE', '1000'))
+BACKFILL_TIME_MARGIN_SECONDS = float(os.environ.get('BACKFILL_TIME_MARGIN_SECONDS', '60'))
+BACKFILL_CHECKPOINT_BUCKET = os.environ.get('BACKFILL_CHECKPOINT_BUCKET')
+BACKFILL_CHECKPOINT_PREFIX = os.environ.get('BACKFILL_CHECKPOINT_PREFIX', 'backfill/')
+BACKFILL_CHECKPOINT_DIR = os.environ.get('BACKFILL_CHECKPOINT_DIR')
+
+# Sweeper Related
+SWEEP_DRY_RUN = os.environ.get('SWEEP_DRY_RUN', 'true') == 'true'
+SWEEP_LOOKBACK_DAYS = int(os.environ.get('SWEEP_LOOKBACK_DAYS', '7'))
+SWEEP_MIN_WORDS = int(os.environ.get('SWEEP_MIN_WORDS', '3'))
+SWEEP_JUNK_TEXTS = json.loads(os.environ.get('SWEEP_JUNK_TEXTS', '["", ".", "null", " null"]'))
+SWEEP_DELETE_BATCH_SIZE = int(os.environ.get('SWEEP_DELETE_BATCH_SIZE', '1000'))
+SWEEP_MAX_WORKERS = int(os.environ.get('SWEEP_MAX_WORKERS', '4'))
+
+# Search Related
+SEARCH_TOP_K = int(os.environ.get('SEARCH_TOP_K', '5'))
+SEARCH_MAX_TOP_K = int(os.environ.get('SEARCH_MAX_TOP_K', '100'))
+SEARCH_EMBEDDING_CACHE_SIZE = int(os.environ.get('SEARCH_EMBEDDING_CACHE_SIZE', '1024'))
+SEARCH_MAX_WORKERS = int(os.environ.get('SEARCH_MAX_WORKERS', '8'))
+
+# Warm Up Related
+WARMUP_TARGETS = [name.strip() for name in os.environ.get('WARMUP_TARGETS', 's3,lambda,dynamodb,deepgram,together,huggingface,openai,pinecone,numpy').split(',') if name.strip()]
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', '2'))
+WARMUP_S3_BUCKET = os.environ.get('WARMUP_S3_BUCKET', RESULT_CACHE_BUCKET)
+
+# Stage Related
+STAGE_TIMEOUT_SECONDS = float(os.environ.get('STAGE_TIMEOUT_SECONDS', '900'))
+STAGE_TIMEOUTS = json.loads(os.environ.get('STAGE_TIMEOUTS', '{}'))
+STAGE_MAX_WORKERS = int(os.environ.get('STAGE_MAX_WORKERS', '4'))
+
+# Metrics Related
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true') == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'MIA/Audio')
+
+# Profiling Related
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false') == 'true'
+PROFILING_BUCKET = os.environ.get('PROFILING_BUCKET')
+PROFILING_PREFIX = os.environ.get('PROFILING_PREFIX', 'profiles/')
+PROFILING_DIR = os.environ.get('PROFILING_DIR')
+PROFILING_TOP_N = int(os.environ.get('PROFILING_TOP_N', '15'))
+PROFILING_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILING_TRACEMALLOC_FRAMES', '1'))
+
+# Cold Start Related
+cold_start = True
+cold_start_timings = {'module_init': round(time.time() - start, 4)}
+# endregion 
+
+# region Clients
+# Clients and their heavy imports are built on first use and cached for warm invocations
+client_cache = {}
+client_lock = threading.RLock()
+
+def lazy_client(name, factory):
+    client = client_cache.get(name)
+    if client is not None:
+        return client
+
+    with client_lock:
+        client = client_cache.get(name)
+        if client is None:
+            client_start = time.time()
+            client = factory()
+            cold_start_timings[name] = round(time.time() - client_start, 4)
+            logger.info(f"Initialized {name} in {cold_start_timings[name]}s")
+            client_cache[name] = client
+
+    return client
+
+def get_boto3_session():
+    def factory():
+        import boto3
+        return boto3.Session()
+    return lazy_client('boto3_session', factory)
+def get_s3():
+    return lazy_client('s3', lambda: get_boto3_session().client('s3'))
+def get_lambda():
+    def factory():
+        from botocore.config import Config
+        config = Config(
+            read_timeout=900,
+            connect_timeout=900,
+            retries={"max_attempts": 0},
+            tcp_keepalive=True,
+        )
+        return get_boto3_session().client('lambda', config=config)
+    return lazy_client('lambda', factory)
+def get_openai_client():
+    def factory():
+        from openai import OpenAI
+        return OpenAI(api_key=OPENAI_API_KEY)
+    return lazy_client('openai', factory)
+def get_embeddings_model():
+    def factory():
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+    return lazy_client('embeddings_model', factory)
+def get_dynamodb():
+    return lazy_client('dynamodb', lambda: get_boto3_session().client('dynamodb'))
+def get_index():
+    def factory():
+        import pinecone
+        pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENV_KEY)
+        return pinecone.Index(PINECONE_INDEX_NAME)
+    return lazy_client('pinecone_index', factory)
+
+def get_http_session(vendor):
+    # One keep-alive session per vendor so warm invocations reuse TCP+TLS connections
+    def factory():
+        from requests.adapters import HTTPAdapter
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        return http_session
+    return lazy_client(f'http_{vendor}', factory)
+
+def http_post(vendor, url, data=None, **kwargs):
+    # POST with connect/read timeouts, jittered exponential backoff on 429/5xx and a total time cap
+    http_session = get_http_session(vendor)
+    deadline = time.time() + HTTP_TOTAL_TIMEOUT
+    # Generators can only be consumed once so they get a single attempt, callables build a fresh body per attempt
+    replayable = data is None or callable(data) or hasattr(data, 'seek') or isinstance(data, (bytes, bytearray, str, dict))
+    max_attempts = HTTP_MAX_RETRIES + 1 if replayable else 1
+
+    for attempt in range(max_attempts):
+        if callable(data):
+            body = data()
+        else:
+            body = data
+            if attempt > 0 and hasattr(body, 'seek'):
+                body.seek(0)
+
+        remaining = deadline - time.time()
+        timeout = (HTTP_CONNECT_TIMEOUT, max(1.0, min(HTTP_READ_TIMEOUT, remaining)))
+        retry_after = None
+        try:
+            with limiting_vendor(vendor) as vendor_call:
+                try:
+                    response = http_session.post(url, data=body, timeout=timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    vendor_call['outcome'] = 'failed'
+                    raise
+                vendor_call['outcome'] = classifying_vendor_status(response.status_code)
+            if response.status_code not in HTTP_RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(f"{vendor} returned {response.status_code}", response=response)
+            retry_after = response.headers.get('Retry-After')
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        if attempt == max_attempts - 1:
+            break
+        backoff = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(0, backoff)
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        if time.time() + delay >= deadline:
+            break
+        logger.info(f"Retrying {vendor} in {delay:.2f}s after attempt {attempt + 1} failed: {error}")
+        time.sleep(delay)
+
+    raise error
+
+def reporting_cold_start():
+    global cold_start
+
+    # Log the per component breakdown once per container, after the first invocation built its clients
+    if cold_start:
+        cold_start = False
+        total = round(sum(cold_start_timings.values()), 4)
+        logger.info(f"Cold start breakdown (total {total}s): {json.dumps(cold_start_timings)}")
+# endregion 
+
+# region Metrics
+# CloudWatch Embedded Metric Format records written straight to stdout, swap metrics_sink to capture them
+metrics_sink = None
+
+def emitting_metrics(metrics, units=None, dimensions=None, properties=None):
+    if not METRICS_ENABLED:
+        return
+    units = units or {}
+    dimensions = dimensions or {}
+
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'None')} for name in metrics],
+            }],
+        },
+    }
+    record.update(properties or {})
+    record.update(dimensions)
+    record.update(metrics)
+
+    line = json.dumps(record, default=str)
+    if metrics_sink is not None:
+        metrics_sink(line)
+    else:
+        print(line, flush=True)
+
+def emitting_record_metrics(record_metrics, status):
+    metrics = {f"{stage}Duration": duration for stage, duration in record_metrics.pop('timings', {}).items()}
+    metrics['TotalDuration'] = round((time.time() - record_metrics.pop('started_at')) * 1000, 2)
+    metrics.update({name: value for name, value in record_metrics.items() if isinstance(value, (int, float)) and not isinstance(value, bool)})
+    units = {name: 'Milliseconds' for name in metrics if name.endswith('Duration')}
+    units.update({'AudioSeconds': 'Seconds', 'AudioBytes': 'Bytes', 'UploadBytes': 'Bytes', 'LlmInputTokens': 'Count', 'LlmOutputTokens': 'Count'})
+    properties = {name: value for name, value in record_metrics.items() if name not in metrics}
+    properties['Status'] = status
+    emitting_metrics(metrics, units, properties=properties)
+
+def emitting_invocation_metrics(entry_point, invocation_start, invocation_cold_start, records, failures):
+    metrics = {
+        'InvocationDuration': round((time.time() - invocation_start) * 1000, 2),
+        'Records': records,
+        'Failures': failures,
+        'ColdStart': int(invocation_cold_start),
+        'VadSkipped': vad_stats['skipped'],
+        'CacheHits': sum(stage_stats['hits'] for stage_stats in result_cache_stats.values()),
+        'CacheMisses': sum(stage_stats['misses'] for stage_stats in result_cache_stats.values()),
+    }
+    units = {name: 'Count' for name in metrics}
+    units['InvocationDuration'] = 'Milliseconds'
+    properties = {'ColdStartBreakdown': cold_start_timings} if invocation_cold_start else {}
+    emitting_metrics(metrics, units, {'EntryPoint': entry_point}, properties)
+    emitting_vendor_metrics()
+# endregion 
+
+# region Profiling
+# Opt-in cProfile and tracemalloc capture per invocation, stage runs are profiled on their own threads
+active_profile = None
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+def hot_functions(stats):
+    # Ranked by own time, cumulative time shows what each function pulled in
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:PROFILING_TOP_N]
+    return [
+        {
+            'function': f"{filename}:{line}({name})",
+            'calls': calls,
+            'own_ms': round(own_time * 1000, 3),
+            'cumulative_ms': round(cumulative_time * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, own_time, cumulative_time, _) in ranked
+    ]
+
+def allocation_sites(statistics):
+    # Snapshots themselves allocate inside tracemalloc, those sites are dropped
+    statistics = [statistic for statistic in statistics if statistic.traceback[0].filename != tracemalloc.__file__]
+    return [
+        {
+            'site': f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+            'size_kb': round(getattr(statistic, 'size_diff', statistic.size) / 1024, 2),
+            'count': getattr(statistic, 'count_diff', statistic.count),
+        }
+        for statistic in statistics[:PROFILING_TOP_N]
+    ]
+
+def merging_profile(name, profiler, statistics, duration):
+    with active_profile['lock']:
+        stage = active_profile['stages'].setdefault(name, {'runs': 0, 'duration_ms': 0, 'stats': None, 'allocations': {}})
+        stage['runs'] += 1
+        stage['duration_ms'] += round(duration * 1000, 2)
+        stage['peak_rss_mb'] = peak_rss_mb()
+        if profiler is not None:
+            if stage['stats'] is None:
+                stage['stats'] = pstats.Stats(profiler)
+            else:
+                stage['stats'].add(profiler)
+        # Allocation growth is summed per site across every run of the stage
+        for site in allocation_sites(statistics):
+            total = stage['allocations'].setdefault(site['site'], {'site': site['site'], 'size_kb': 0, 'count': 0})
+            total['size_kb'] = round(total['size_kb'] + site['size_kb'], 2)
+            total['count'] += site['count']
+
+@contextmanager
+def profiling_stage(name):
+    if active_profile is None:
+        yield
+        return
+
+    # The snapshot is taken outside the profiled window so it never shows up as a hot function
+    snapshot = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already owns this thread
+        profiler = None
+    stage_start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - stage_start
+        if profiler is not None:
+            profiler.disable()
+        # Concurrent stages share the heap, so a diff can include a sibling's allocations
+        statistics = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+        merging_profile(name, profiler, statistics, duration)
+
+def writing_profile(report):
+    body = json.dumps(report, default=str)
+    name = f"{report['entry_point']}/{datetime.utcfromtimestamp(report['started_at']).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+    if PROFILING_BUCKET:
+        get_s3().put_object(Bucket=PROFILING_BUCKET, Key=f"{PROFILING_PREFIX}{name}", Body=body.encode('utf-8'), ContentType='application/json')
+        return f"s3://{PROFILING_BUCKET}/{PROFILING_PREFIX}{name}"
+    if PROFILING_DIR:
+        path = os.path.join(PROFILING_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as profile_file:
+            profile_file.write(body)
+        return path
+    logger.info(f"Profile: {body}")
+    return None
+
+@contextmanager
+def profiling_invocation(entry_point, event):
+    global active_profile
+
+    if not (PROFILING_ENABLED or (isinstance(event, dict) and event.get('profile'))) or active_profile is not None:
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    active_profile = {'lock': threading.Lock(), 'stages': {}}
+    rss_before = peak_rss_mb()
+    invocation_start = time.time()
+    try:
+        # The handler thread itself is profiled as one more stage
+        with profiling_stage('invocation'):
+            yield
+    finally:
+        profile, active_profile = active_profile, None
+        _, traced_peak = tracemalloc.get_traced_memory()
+        top_allocations = allocation_sites(tracemalloc.take_snapshot().statistics('lineno'))
+        if started_tracing:
+            tracemalloc.stop()
+
+        report = {
+            'entry_point': entry_point,
+            'started_at': invocation_start,
+            'duration_ms': round((time.time() - invocation_start) * 1000, 2),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_growth_mb': round(peak_rss_mb() - rss_before, 2),
+            'traced_peak_mb': round(traced_peak / 1024 / 1024, 2),
+            'top_allocations': top_allocations,
+            'stages': {
+                name: {
+                    'runs': stage['runs'],
+                    'duration_ms': stage['duration_ms'],
+                    'peak_rss_mb': stage['peak_rss_mb'],
+                    'hot_functions': hot_functions(stage['stats']) if stage['stats'] is not None else [],
+                    'allocations': sorted(stage['allocations'].values(), key=lambda site: site['size_kb'], reverse=True)[:PROFILING_TOP_N],
+                }
+                for name, stage in profile['stages'].items()
+            },
+        }
+        try:
+            location = writing_profile(report)
+            logger.info(f"Profiled {entry_point} (peak RSS {report['peak_rss_mb']} MB){f' to {location}' if location else ''}")
+        except Exception as e:
+            logger.error(f"Error writing profile: {e}")
+
+def profiling_handler(entry_point):
+    def wrapping(function):
+        @functools.wraps(function)
+        def profiled(event, context):
+            with profiling_invocation(entry_point, event):
+                return function(event, context)
+        return profiled
+    return wrapping
+# endregion 
+
+# region Vendor Limits
+# Per vendor token bucket plus AIMD concurrency, shrinking on 429s, 5xx and timeouts and growing back only on success
+vendor_limiters = {}
+vendor_limiters_lock = threading.Lock()
+
+def get_vendor_limiter(vendor):
+    with vendor_limiters_lock:
+        limiter = vendor_limiters.get(vendor)
+        if limiter is None:
+            overrides = VENDOR_LIMITS.get(vendor, {})
+            rate = float(overrides.get('rate', VENDOR_RATE_PER_SECOND))
+            limiter = {
+                'condition': threading.Condition(),
+                'limit': float(overrides.get('concurrency', VENDOR_INITIAL_CONCURRENCY)),
+                'min_limit': float(overrides.get('min_concurrency', VENDOR_MIN_CONCURRENCY)),
+                'max_limit': float(overrides.get('max_concurrency', VENDOR_MAX_CONCURRENCY)),
+                'rate': rate,
+                'tokens': rate,
+                'refilled_at': time.time(),
+                'decreased_at': 0.0,
+                'in_flight': 0,
+                'calls': 0,
+                'throttled': 0,
+                'failed': 0,
+                'wait_seconds': 0.0,
+            }
+            vendor_limiters[vendor] = limiter
+        return limiter
+
+def refilling_tokens(limiter, now):
+    limiter['tokens'] = min(limiter['rate'], limiter['tokens'] + (now - limiter['refilled_at']) * limiter['rate'])
+    limiter['refilled_at'] = now
+
+@contextmanager
+def limiting_vendor(vendor):
+    limiter = get_vendor_limiter(vendor)
+    condition = limiter['condition']
+    wait_start = time.time()
+
+    with condition:
+        while True:
+            now = time.time()
+            refilling_tokens(limiter, now)
+            if limiter['in_flight'] < max(1, int(limiter['limit'])) and limiter['tokens'] >= 1.0:
+                break
+            # Sleep until the next token is due or a slot is released
+            condition.wait(timeout=max(0.01, (1.0 - limiter['tokens']) / limiter['rate']) if limiter['tokens'] < 1.0 else None)
+        limiter['tokens'] -= 1.0
+        limiter['in_flight'] += 1
+        limiter['calls'] += 1
+        limiter['wait_seconds'] += time.time() - wait_start
+
+    # No recorded outcome (client errors, unexpected exceptions) holds the limit where it is
+    vendor_call = {'outcome': None}
+    try:
+        yield vendor_call
+    finally:
+        with condition:
+            limiter['in_flight'] -= 1
+            now = time.time()
+            outcome = vendor_call['outcome']
+            if outcome in ('throttled', 'failed'):
+                limiter[outcome] += 1
+                # Halve at most once per cooldown so one burst of 429s doesn't collapse the limit
+                if now - limiter['decreased_at'] >= VENDOR_DECREASE_COOLDOWN:
+                    limiter['limit'] = max(limiter['min_limit'], limiter['limit'] / 2.0)
+                    limiter['decreased_at'] = now
+                    logger.info(f"{vendor} call {outcome}, concurrency limit now {limiter['limit']:.2f}")
+            elif outcome == 'success':
+                limiter['limit'] = min(limiter['max_limit'], limiter['limit'] + 1.0 / limiter['limit'])
+            condition.notify_all()
+
+def classifying_vendor_status(status):
+    if status == 429:
+        return 'throttled'
+    if status is not None and status >= 500:
+        return 'failed'
+    if status is not None and status < 400:
+        return 'success'
+    return None
+
+def classifying_vendor_error(error):
+    # SDKs wrap 429s, 5xx and network failures in their own exception types
+    name = type(error).__name__
+    if 'RateLimit' in name:
+        return 'throttled'
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)) or 'Timeout' in name or 'Connection' in name:
+        return 'failed'
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    return classifying_vendor_status(status) if isinstance(status, int) and status >= 400 else None
+
+def calling_vendor(vendor, function):
+    # SDK calls report throttling, server errors and timeouts through exceptions instead of responses
+    with limiting_vendor(vendor) as vendor_call:
+        try:
+            result = function()
+        except Exception as e:
+            vendor_call['outcome'] = classifying_vendor_error(e)
+            raise
+        vendor_call['outcome'] = 'success'
+        return result
+
+def emitting_vendor_metrics():
+    # Current limit and in-flight count, plus calls, 429s, 5xx/timeouts and time spent waiting since the last emit
+    with vendor_limiters_lock:
+        limiters = dict(vendor_limiters)
+    for vendor, limiter in limiters.items():
+        with limiter['condition']:
+            reported = limiter.setdefault('reported', {'calls': 0, 'throttled': 0, 'failed': 0, 'wait_seconds': 0.0})
+            metrics = {
+                'VendorConcurrencyLimit': round(limiter['limit'], 2),
+                'VendorInFlight': limiter['in_flight'],
+                'VendorCalls': limiter['calls'] - reported['calls'],
+                'VendorThrottled': limiter['throttled'] - reported['throttled'],
+                'VendorErrors': limiter['failed'] - reported['failed'],
+                'VendorWaitTime': round((limiter['wait_seconds'] - reported['wait_seconds']) * 1000, 2),
+            }
+            limiter['reported'] = {'calls': limiter['calls'], 'throttled': limiter['throttled'], 'failed': limiter['failed'], 'wait_seconds': limiter['wait_seconds']}
+        units = {name: 'Count' for name in metrics}
+        units['VendorWaitTime'] = 'Milliseconds'
+        emitting_metrics(metrics, units, {'Vendor': vendor})
+
+def reporting_vendor_limits():
+    report = {}
+    with vendor_limiters_lock:
+        limiters = dict(vendor_limiters)
+    for vendor, limiter in limiters.items():
+        with limiter['condition']:
+            report[vendor] = {
+                'limit': round(limiter['limit'], 2),
+                'in_flight': limiter['in_flight'],
+                'calls': limiter['calls'],
+                'throttled': limiter['throttled'],
+                'failed': limiter['failed'],
+                'wait_seconds': round(limiter['wait_seconds'], 4),
+            }
+    return report
+# endregion 
+
+# region Result Cache
+# Stage outputs keyed by audio content (S3 ETag) or input text plus the model/prompt configuration
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()
+result_cache_stats = {}
+
+def result_cache_key(stage, *parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return f"{stage}/{digest.hexdigest()}"
+
+def counting_result_cache(stage, outcome):
+    with result_cache_lock:
+        stage_stats = result_cache_stats.setdefault(stage, {'hits': 0, 'misses': 0})
+        stage_stats[outcome] += 1
+
+def resetting_result_cache_stats():
+    with result_cache_lock:
+        result_cache_stats.clear()
+
+def reading_durable_result_cache(key):
+    if RESULT_CACHE_BUCKET:
+        s3 = get_s3()
+        try:
+            cache_object = s3.get_object(Bucket=RESULT_CACHE_BUCKET, Key=f"{RESULT_CACHE_PREFIX}{key}.json")
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(cache_object['Body'].read())
+
+    if RESULT_CACHE_DIR:
+        cache_path = os.path.join(RESULT_CACHE_DIR, f"{key}.json")
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+
+    return None
+
+def writing_durable_result_cache(key, entry):
+    if RESULT_CACHE_BUCKET:
+        get_s3().put_object(Bucket=RESULT_CACHE_BUCKET, Key=f"{RESULT_CACHE_PREFIX}{key}.json", Body=json.dumps(entry).encode('utf-8'))
+    elif RESULT_CACHE_DIR:
+        cache_path = os.path.join(RESULT_CACHE_DIR, f"{key}.json")
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(entry, cache_file)
+
+def writing_memory_result_cache(key, entry):
+    with result_cache_lock:
+        result_cache[key] = entry
+        result_cache.move_to_end(key)
+        while len(result_cache) > RESULT_CACHE_SIZE:
+            result_cache.popitem(last=False)
+
+def reading_result_cache(stage, key_parts):
+    key = result_cache_key(stage, *key_parts)
+
+    # In-process LRU tier for warm containers
+    with result_cache_lock:
+        entry = result_cache.get(key)
+        if entry is not None:
+            result_cache.move_to_end(key)
+    if entry is not None:
+        counting_result_cache(stage, 'hits')
+        return entry
+
+    # Durable tier, a broken cache must never fail the pipeline
+    try:
+        entry = reading_durable_result_cache(key)
+    except Exception as e:
+        logger.error(f'Error reading result cache {key}: {e}')
+        entry = None
+    if entry is not None:
+        writing_memory_result_cache(key, entry)
+        counting_result_cache(stage, 'hits')
+        return entry
+
+    counting_result_cache(stage, 'misses')
+    return None
+
+def writing_result_cache(stage, key_parts, value):
+    key = result_cache_key(stage, *key_parts)
+    entry = {'value': value}
+    writing_memory_result_cache(key, entry)
+    try:
+        writing_durable_result_cache(key, entry)
+    except Exception as e:
+        logger.error(f'Error writing result cache {key}: {e}')
+
+def cached_result(stage, key_parts, compute):
+    if not RESULT_CACHE_ENABLED:
+        return compute()
+
+    entry = reading_result_cache(stage, key_parts)
+    if entry is not None:
+        return entry['value']
+
+    # None marks a result that depends on more than the key, e.g. a voice activity skip
+    value = compute()
+    if value is not None:
+        writing_result_cache(stage, key_parts, value)
+
+    return value
+# endregion 
+
+# region Ledger
+# Claims an object before any paid work starts so redeliveries and concurrent duplicates short-circuit
+ledger = OrderedDict()
+ledger_lock = threading.Lock()
+
+def ledger_key(record, bucket_name, initial_object_key):
+    # The version (or ETag on unversioned buckets) separates a genuine re-upload from a redelivery
+    s3_object = record.get('s3', {}).get('object', {})
+    object_version = s3_object.get('versionId') or s3_object.get('eTag') or ''
+    return f"{bucket_name}/{initial_object_key}/{object_version}"
+
+def vector_key(record, bucket_name, initial_object_key):
+    # Always the ETag, S3 listings used by backfills carry it but not the version
+    s3_object = record.get('s3', {}).get('object', {})
+    object_etag = (s3_object.get('eTag') or '').strip('"')
+    return f"{bucket_name}/{initial_object_key}/{object_etag}"
+
+def deterministic_vector_id(key):
+    return str(uuid.uuid5(VECTOR_ID_NAMESPACE, key))
+
+def claiming_in_memory_ledger(key, now):
+    with ledger_lock:
+        entry = ledger.get(key)
+        if entry is not None and (entry['status'] == 'done' or entry['claimed_at'] > now - LEDGER_CLAIM_TTL):
+            return False
+        ledger[key] = {'status': 'processing', 'claimed_at': now}
+        ledger.move_to_end(key)
+        while len(ledger) > LEDGER_MEMORY_SIZE:
+            ledger.popitem(last=False)
+        return True
+
+def ledger_path(key):
+    return os.path.join(LEDGER_DIR, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+
+def claiming_file_ledger(key, now):
+    path = ledger_path(key)
+    os.makedirs(LEDGER_DIR, exist_ok=True)
+    for _ in range(2):
+        try:
+            # O_EXCL makes creation the atomic claim
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path, 'r', encoding='utf-8') as ledger_file:
+                    entry = json.load(ledger_file)
+            except (OSError, ValueError):
+                return False
+            if entry['status'] == 'done' or entry['claimed_at'] > now - LEDGER_CLAIM_TTL:
+                return False
+            # Stale claim from a crashed worker
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w', encoding='utf-8') as ledger_file:
+            json.dump({'key': key, 'status': 'processing', 'claimed_at': now}, ledger_file)
+        return True
+    return False
+
+def claiming_dynamodb_ledger(key, now):
+    dynamodb = get_dynamodb()
+    try:
+        dynamodb.put_item(
+            TableName=LEDGER_TABLE_NAME,
+            Item={
+                'ledger_key': {'S': key},
+                'status': {'S': 'processing'},
+                'claimed_at': {'N': str(now)},
+            },
+            ConditionExpression='attribute_not_exists(ledger_key) OR (#status = :processing AND claimed_at < :expired)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':processing': {'S': 'processing'},
+                ':expired': {'N': str(now - LEDGER_CLAIM_TTL)},
+            },
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+
+def claiming_ledger(key):
+    now = time.time()
+    if LEDGER_TABLE_NAME:
+        return claiming_dynamodb_ledger(key, now)
+    if LEDGER_DIR:
+        return claiming_file_ledger(key, now)
+    return claiming_in_memory_ledger(key, now)
+
+def completing_ledger(key):
+    now = time.time()
+    if LEDGER_TABLE_NAME:
+        get_dynamodb().put_item(
+            TableName=LEDGER_TABLE_NAME,
+            Item={
+                'ledger_key': {'S': key},
+                'status': {'S': 'done'},
+                'claimed_at': {'N': str(now)},
+            },
+        )
+    elif LEDGER_DIR:
+        with open(ledger_path(key), 'w', encoding='utf-8') as ledger_file:
+            json.dump({'key': key, 'status': 'done', 'claimed_at': now}, ledger_file)
+    else:
+        with ledger_lock:
+            ledger[key] = {'status': 'done', 'claimed_at': now}
+
+def releasing_ledger(key):
+    # Drop a failed claim so the retry is allowed to do the work
+    try:
+        if LEDGER_TABLE_NAME:
+            get_dynamodb().delete_item(
+                TableName=LEDGER_TABLE_NAME,
+                Key={'ledger_key': {'S': key}},
+                ConditionExpression='#status = :processing',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':processing': {'S': 'processing'}},
+            )
+        elif LEDGER_DIR:
+            os.remove(ledger_path(key))
+        else:
+            with ledger_lock:
+                ledger.pop(key, None)
+    except Exception as e:
+        logger.error(f'Error releasing ledger claim {key}: {e}')
+# endregion 
+
+# region Voice Activity
+# Per invocation counts of files checked for speech and files skipped before any paid call
+vad_stats = {'checked': 0, 'skipped': 0}
+vad_lock = threading.Lock()
+
+def counting_vad(outcome):
+    with vad_lock:
+        vad_stats[outcome] += 1
+
+def resetting_vad_stats():
+    with vad_lock:
+        vad_stats.update({'checked': 0, 'skipped': 0})
+# endregion 
+
+# region Audio
+# PCM WAV helpers, compressed containers are sent to STT untouched
+def is_wav(audio_bytes):
+    return audio_bytes[:4] == b'RIFF' and audio_bytes[8:12] == b'WAVE'
+
+def sniffing_content_type(header):
+    # Container from the magic bytes, the S3 key and metadata can't be trusted
+    if is_wav(header):
+        return 'audio/wav'
+    if header[4:8] == b'ftyp':
+        return 'audio/mp4'
+    if header[:3] == b'ID3' or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'audio/mpeg'
+    if header[:4] == b'OggS':
+        return 'audio/ogg'
+    if header[:4] == b'fLaC':
+        return 'audio/flac'
+    if header[:4] == b'\x1aE\xdf\xa3':
+        return 'audio/webm'
+    if header[:5] == b'#!AMR':
+        return 'audio/amr'
+    return 'audio/wav'
+
+def decoding_wav(audio_bytes):
+    import numpy as np
+
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    dtypes = {1: np.uint8, 2: np.int16, 4: np.int32}
+    if sample_width not in dtypes:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+    samples = np.frombuffer(frames, dtype=dtypes[sample_width]).reshape(-1, channels)
+
+    return samples, sample_rate
+
+def decoding_wav_or_none(audio_bytes):
+    # 24-bit, float and WAVE_FORMAT_EXTENSIBLE files are not decodable here, callers send those on unchanged
+    try:
+        return decoding_wav(audio_bytes)
+    except (wave.Error, ValueError, EOFError) as e:
+        logger.info(f"Cannot decode WAV in process: {e}")
+        return None, None
+
+def encoding_wav(samples, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(samples.dtype.itemsize)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def samples_to_float(samples):
+    import numpy as np
+
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    return samples.astype(np.float32) / float(np.iinfo(samples.dtype).max)
+
+def float_to_samples(audio, dtype):
+    import numpy as np
+
+    clipped = np.clip(audio, -1.0, 1.0)
+    if dtype == np.uint8:
+        return (clipped * 127.0 + 128.0).astype(np.uint8)
+    return (clipped * np.iinfo(dtype).max).astype(dtype)
+
+def frame_energies(samples, sample_rate, frame_seconds=0.02):
+    import numpy as np
+
+    # Mean square energy per frame across channels, normalized to [0, 1]
+    frame_length = max(1, int(sample_rate * frame_seconds))
+    frame_count = len(samples) // frame_length
+    normalized = samples if samples.dtype == np.float32 else samples_to_float(samples)
+    # Channels are explicit so a recording shorter than one frame still reshapes to zero frames
+    channels = normalized.shape[1] if normalized.ndim > 1 else 1
+    framed = normalized[:frame_count * frame_length].reshape(frame_count, frame_length, channels)
+    return np.mean(np.square(framed), axis=(1, 2)), frame_length
+
+def voiced_frames(energies):
+    import numpy as np
+
+    # A frame is voiced when it is above the absolute threshold and clearly above the recording's noise floor
+    energies_db = 10.0 * np.log10(energies + 1e-12)
+    noise_floor_db = np.percentile(energies_db, 10)
+    threshold_db = max(VAD_ENERGY_THRESHOLD_DB, noise_floor_db + VAD_NOISE_MARGIN_DB)
+    return energies_db > threshold_db, threshold_db
+
+def detecting_speech(samples, sample_rate):
+    import numpy as np
+
+    energies, frame_length = frame_energies(samples, sample_rate)
+    if len(energies) == 0:
+        return False
+    voiced, threshold_db = voiced_frames(energies)
+    voiced_seconds = np.count_nonzero(voiced) * frame_length / sample_rate
+    logger.info(f"Voice activity: {voiced_seconds:.2f}s above {threshold_db:.1f} dB")
+
+    return voiced_seconds >= VAD_MIN_SPEECH_SECONDS
+
+def removing_silence(audio, sample_rate):
+    import numpy as np
+
+    energies, frame_length = frame_energies(audio, sample_rate)
+    if len(energies) == 0:
+        return audio
+    voiced, _ = voiced_frames(energies)
+
+    # Widen every voiced frame by the padding so word onsets and tails survive
+    padding = int(AUDIO_SILENCE_PADDING_SECONDS * sample_rate / frame_length)
+    if padding > 0:
+        voiced = np.convolve(voiced.astype(np.int32), np.ones(2 * padding + 1, dtype=np.int32), mode='same') > 0
+    keep = np.repeat(voiced, frame_length)
+    return audio[:len(keep)][keep]
+
+def normalizing_loudness(audio):
+    import numpy as np
+
+    rms = float(np.sqrt(np.mean(np.square(audio)))) if audio.size else 0.0
+    if rms <= 0.0:
+        return audio
+    gain = 10.0 ** (AUDIO_TARGET_LOUDNESS_DB / 20.0) / rms
+    # Never push the peak into clipping
+    peak = float(np.max(np.abs(audio)))
+    gain = min(gain, 0.99 / peak)
+    return audio * np.float32(gain)
+
+def filtering_music(audio, sample_rate, block_frames=2048):
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    # Spectral gating against the stationary background (music, hum) with a 50% overlap sqrt-Hann STFT
+    size = AUDIO_STFT_SIZE
+    hop = size // 2
+    window = np.sqrt(np.hanning(size + 1)[:-1]).astype(np.float32)
+    filtered = np.empty_like(audio)
+
+    for channel in range(audio.shape[1]):
+        padded = np.pad(audio[:, channel], (size, size + hop - (len(audio) % hop)))
+        frames = sliding_window_view(padded, size)[::hop]
+        frame_count = len(frames)
+
+        # Background floor per frequency bin from a bounded sample of frames
+        sample_step = max(1, frame_count // 2000)
+        sampled = np.abs(np.fft.rfft(frames[::sample_step] * window, axis=1))
+        floor = np.percentile(sampled, 20, axis=0)
+
+        output = np.zeros((frame_count + 1, hop), dtype=np.float32)
+        for block_start in range(0, frame_count, block_frames):
+            block = frames[block_start:block_start + block_frames]
+            spectrum = np.fft.rfft(block * window, axis=1)
+            magnitude = np.abs(spectrum) + 1e-12
+            gain = np.clip((magnitude - AUDIO_MUSIC_SUPPRESSION * floor) / magnitude, AUDIO_MUSIC_MIN_GAIN, 1.0)
+            rebuilt = (np.fft.irfft(spectrum * gain, n=size, axis=1) * window).astype(np.float32)
+            # Overlap-add, each frame covers two consecutive hops
+            output[block_start:block_start + len(block)] += rebuilt[:, :hop]
+            output[block_start + 1:block_start + len(block) + 1] += rebuilt[:, hop:]
+
+        filtered[:, channel] = output.reshape(-1)[size:size + len(audio)]
+
+    return filtered
+
+def resampling(audio, sample_rate, target_rate):
+    import numpy as np
+
+    if len(audio) == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    # Windowed-sinc low-pass below the new Nyquist, then linear interpolation onto the target grid
+    cutoff = 0.5 * target_rate / sample_rate
+    taps = np.arange(STT_RESAMPLE_TAPS) - (STT_RESAMPLE_TAPS - 1) / 2.0
+    kernel = (2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(STT_RESAMPLE_TAPS)).astype(np.float32)
+    filtered = np.convolve(audio, kernel / kernel.sum(), mode='same')
+
+    target_length = int(len(audio) * target_rate / sample_rate)
+    positions = np.arange(target_length, dtype=np.float64) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), filtered).astype(np.float32)
+
+def preparing_speech_samples(samples, sample_rate):
+    import numpy as np
+
+    # Mono 16-bit at the model's rate, never upsampling
+    if samples.shape[1] == 1 and sample_rate <= STT_TARGET_SAMPLE_RATE and samples.dtype != np.int32:
+        return samples, sample_rate
+    audio = samples_to_float(samples).mean(axis=1)
+    if sample_rate > STT_TARGET_SAMPLE_RATE:
+        audio = resampling(audio, sample_rate, STT_TARGET_SAMPLE_RATE)
+        sample_rate = STT_TARGET_SAMPLE_RATE
+    return float_to_samples(audio, np.int16 if samples.dtype != np.uint8 else np.uint8).reshape(-1, 1), sample_rate
+
+def cleaning_audio_in_process(audio_bytes, audiofile_metadata):
+    # Same flags the audio cleaning Lambda reads, applied to the in-memory samples
+    if not is_wav(audio_bytes):
+        return None
+    samples, sample_rate = decoding_wav_or_none(audio_bytes)
+    if samples is None:
+        return None
+    audio = samples_to_float(samples)
+
+    if audiofile_metadata.get("filtermusic") == "true":
+        audio = filtering_music(audio, sample_rate)
+    if audiofile_metadata.get("removesilence") == "true":
+        audio = removing_silence(audio, sample_rate)
+    if audiofile_metadata.get("normalizeloudness") == "true":
+        audio = normalizing_loudness(audio)
+    logger.info(f"Cleaned audio in process: {len(samples) / sample_rate:.1f}s -> {len(audio) / sample_rate:.1f}s")
+
+    return encoding_wav(float_to_samples(audio, samples.dtype), sample_rate)
+
+def finding_segment_bounds(samples, sample_rate):
+    import numpy as np
+
+    # Cut near every TRANSCRIPTION_SEGMENT_SECONDS at the quietest frame within the search window
+    total = len(samples)
+    energies, frame_length = frame_energies(samples, sample_rate)
+    segment_length = int(TRANSCRIPTION_SEGMENT_SECONDS * sample_rate)
+    search = int(TRANSCRIPTION_SILENCE_SEARCH_SECONDS * sample_rate)
+    overlap = int(TRANSCRIPTION_SEGMENT_OVERLAP_SECONDS * sample_rate)
+
+    cuts = [0]
+    while total - cuts[-1] > segment_length:
+        target = cuts[-1] + segment_length
+        low_frame = max(cuts[-1] + overlap + 1, target - search) // frame_length
+        high_frame = min(total - overlap - 1, target + search) // frame_length
+        if high_frame <= low_frame or high_frame > len(energies):
+            cut = target
+        else:
+            cut = (low_frame + int(np.argmin(energies[low_frame:high_frame]))) * frame_length
+        cuts.append(cut)
+    cuts.append(total)
+
+    # Each segment owns [cut, next cut) and is padded by the overlap on both sides
+    return [
+        (max(0, cuts[i] - overlap), min(total, cuts[i + 1] + overlap), cuts[i], cuts[i + 1])
+        for i in range(len(cuts) - 1)
+    ]
+
+def mapping_segment_speakers(previous_words, words, known_speakers):
+    # Vote each local speaker onto the global speaker of the time-overlapping words from the previous segment
+    votes = {}
+    for start, end, speaker, _ in words:
+        best_overlap, best_speaker = 0.0, None
+        for previous_start, previous_end, previous_speaker, _ in previous_words:
+            word_overlap = min(end, previous_end) - max(start, previous_start)
+            if word_overlap > best_overlap:
+                best_overlap, best_speaker = word_overlap, previous_speaker
+        if best_speaker is not None:
+            speaker_votes = votes.setdefault(speaker, {})
+            speaker_votes[best_speaker] = speaker_votes.get(best_speaker, 0) + 1
+    mapping = {speaker: max(speaker_votes, key=speaker_votes.get) for speaker, speaker_votes in votes.items()}
+
+    # Speakers silent in the overlap are matched by elimination onto known speakers this segment has not claimed,
+    # most recently heard first, and only get a new label once every known speaker is taken
+    claimed = set(mapping.values())
+    candidates = [speaker for speaker in sorted(known_speakers, key=known_speakers.get, reverse=True) if speaker not in claimed]
+    next_speaker = len(known_speakers)
+    for _, _, speaker, _ in words:
+        if speaker in mapping:
+            continue
+        if candidates:
+            mapping[speaker] = candidates.pop(0)
+        else:
+            mapping[speaker] = next_speaker
+            next_speaker += 1
+    return mapping
+
+def stitching_segment_words(segment_responses, segment_bounds, sample_rate):
+    kept_words = []
+    previous_words = []
+    # Global speaker label to the end time of their last word
+    known_speakers = {}
+
+    for response_json, (start, end, own_start, own_end) in zip(segment_responses, segment_bounds):
+        offset = start / sample_rate
+        alternative = response_json['results']['channels'][0]['alternatives'][0]
+        words = [
+            (offset + word['start'], offset + word['end'], word.get('speaker', 0), word.get('punctuated_word', word['word']))
+            for word in alternative.get('words', [])
+        ]
+
+        mapping = mapping_segment_speakers(previous_words, words, known_speakers)
+        words = [(word_start, word_end, mapping[speaker], text) for word_start, word_end, speaker, text in words]
+        for _, word_end, speaker, _ in words:
+            known_speakers[speaker] = max(known_speakers.get(speaker, 0.0), word_end)
+
+        # Only keep the words that start inside the segment's own region so the overlap is not duplicated
+        kept_words.extend(word for word in words if own_start / sample_rate <= word[0] < own_end / sample_rate)
+        previous_words = words
+
+    # Rebuild a diarized transcript in the same shape as Deepgram's paragraphs
+    paragraphs = []
+    for word_start, word_end, speaker, text in sorted(kept_words):
+        if paragraphs and paragraphs[-1][0] == speaker:
+            paragraphs[-1][1].append(text)
+        else:
+            paragraphs.append((speaker, [text]))
+    return "\n\n".join(f"Speaker {speaker}: {' '.join(texts)}" for speaker, texts in paragraphs)
+
+def transcribing_in_segments(audio_bytes):
+    # Long PCM recordings are split at silences and transcribed in parallel, anything else goes in one routed request
+    content_type = sniffing_content_type(audio_bytes[:12])
+    # Stitching needs Deepgram's diarized word timings, so only that path is tied to Deepgram
+    if not is_wav(audio_bytes) or 'deepgram' not in STT_BACKENDS:
+        return routing_backend_call('stt', audio_bytes, content_type=content_type)
+    samples, sample_rate = decoding_wav_or_none(audio_bytes)
+    if samples is None or len(samples) <= TRANSCRIPTION_SEGMENT_SECONDS * sample_rate:
+        return routing_backend_call('stt', audio_bytes, content_type=content_type)
+
+    segment_bounds = finding_segment_bounds(samples, sample_rate)
+    logger.info(f"Transcribing {len(samples) / sample_rate:.1f}s of audio in {len(segment_bounds)} segments")
+
+    def transcribing_segment(bounds):
+        start, end, _, _ = bounds
+        return deepgram_response(encoding_wav(samples[start:end], sample_rate))
+
+    max_workers = max(1, min(TRANSCRIPTION_MAX_WORKERS, len(segment_bounds)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        segment_responses = list(executor.map(transcribing_segment, segment_bounds))
+
+    final_transcript = stitching_segment_words(segment_responses, segment_bounds, sample_rate)
+    logger.info(f"Deepgram API stitched final_transcript: {final_transcript}\n")
+    return final_transcript
+# endregion 
+
+# region Stages
+# Per file pipeline as a dependency graph, independent stages run concurrently
+def pipeline_stage(name, function, dependencies=()):
+    return {'name': name, 'function': function, 'dependencies': tuple(dependencies), 'timeout': float(STAGE_TIMEOUTS.get(name, STAGE_TIMEOUT_SECONDS))}
+
+def timing_stage(stage, timings):
+    def run(results):
+        stage_start = time.time()
+        try:
+            with profiling_stage(stage['name']):
+                return stage['function'](results)
+        finally:
+            timings[stage['name']] = round((time.time() - stage_start) * 1000, 2)
+    return run
+
+def running_stages(stages, results=None, timings=None):
+    results = {} if results is None else results
+    timings = {} if timings is None else timings
+    pending = {stage['name']: stage for stage in stages}
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, min(STAGE_MAX_WORKERS, len(stages))))
+
+    try:
+        while pending or running:
+            # Submit every stage whose dependencies have finished
+            for name, stage in list(pending.items()):
+                if all(dependency in results for dependency in stage['dependencies']):
+                    del pending[name]
+                    future = executor.submit(timing_stage(stage, timings), results)
+                    running[future] = (name, time.time() + stage['timeout'])
+            if not running:
+                raise RuntimeError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+
+            next_deadline = min(deadline for _, deadline in running.values())
+            done, _ = wait(list(running), timeout=max(0.0, next_deadline - time.time()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = running.pop(future)
+                # Raising here skips every stage that has not started yet
+                results[name] = future.result()
+
+            now = time.time()
+            for future, (name, deadline) in running.items():
+                if future not in done and deadline <= now:
+                    raise TimeoutError(f"Stage {name} timed out")
+
+        return results
+
+    finally:
+        # Running stages cannot be interrupted, queued ones are cancelled
+        executor.shutdown(wait=False, cancel_futures=True)
 # endregion 
 
 # region Functions
 def pulling_s3_object_details(event):
     logger.info(f'Pulling S3 Object Details...')
 
-    # Get global bucket name and object key from the event
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    initial_object_key = event['Records'][0]['s3']['object']['key']
-    logger.info(f"Event\nBucket Name: {bucket_name}\nObject Key: {initial_object_key}")
+    # Get bucket name and object key of every record in the event
+    object_details = []
+    for record in event.get('Records', []):
+        bucket_name = record['s3']['bucket']['name']
+        initial_object_key = record['s3']['object']['key']
+        logger.info(f"Event\nBucket Name: {bucket_name}\nObject Key: {initial_object_key}")
+        object_details.append((record, bucket_name, initial_object_key))
 
-    return bucket_name, initial_object_key
+    return object_details
 
-def downloading_s3_objects(event, bucket_name, initial_object_key):
+def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
     logger.info(f'Downloading S3 Objects (audio file and metadata)...')
 
     # Retrieve metadata for the object
-    audiofile_s3obj = s3.head_object(Bucket=bucket_name, Key=initial_object_key)
+    audiofile_s3obj = get_s3().head_object(Bucket=bucket_name, Key=initial_object_key)
     audiofile_metadata = audiofile_s3obj.get('Metadata', {})
     logger.info(f"Audio File Metadata: {audiofile_metadata}\n")
 
     # Check if audio cleaning is required by flag
-    final_object_key = clean_or_not_final_audio_path(event, bucket_name, initial_object_key, audiofile_metadata)
+    final_object_key, cleaned_audio_bytes = clean_or_not_final_audio_path(event, bucket_name, initial_object_key, audiofile_s3obj, audiofile_metadata, remote_cleaning)
     logger.info(f"Final Audio File's Object Key: {final_object_key}")
 
-    # Create a path to download the final audio file
+    # In process cleaning already holds the audio, streaming mode pipes the S3 body straight into the STT request later on
+    if cleaned_audio_bytes is not None or AUDIO_TRANSFER_MODE != 'disk':
+        logger.info(f"Streaming audio file from S3 instead of downloading")
+        return audiofile_s3obj, final_object_key, None, audiofile_metadata, cleaned_audio_bytes
+
+    # Create a unique path to download the final audio file, records sharing a basename run concurrently
     audiofile_name = final_object_key.split("/")[-1].strip()
     updated_audiofile_name = audiofile_name.replace("\"", "").strip()
-    audiofile_download_path = os.path.join('/tmp', updated_audiofile_name)
+    audiofile_fd, audiofile_download_path = tempfile.mkstemp(dir='/tmp', suffix=os.path.splitext(updated_audiofile_name)[1])
+    os.close(audiofile_fd)
     logger.info(f"Audio file name: {audiofile_name} - Audio file download path: {audiofile_download_path}")
-    s3.download_file(bucket_name, final_object_key, audiofile_download_path)
+    get_s3().download_file(bucket_name, final_object_key, audiofile_download_path)
     
-    return audiofile_s3obj, final_object_key, audiofile_download_path, audiofile_metadata
+    return audiofile_s3obj, final_object_key, audiofile_download_path, audiofile_metadata, None
 
-def start_processing(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata):
-    logger.info(f'Starting processing audio..')
+def streaming_s3_object(bucket_name, object_key):
+    # Yield the object in fixed size chunks so memory stays bounded by STREAM_CHUNK_SIZE
+    audiofile_body = get_s3().get_object(Bucket=bucket_name, Key=object_key)['Body']
+    try:
+        for chunk in audiofile_body.iter_chunks(chunk_size=STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        audiofile_body.close()
 
+def peeking_audio_header(bucket_name, object_key, audiofile_download_path, length=12):
+    if audiofile_download_path is None:
+        return get_s3().get_object(Bucket=bucket_name, Key=object_key, Range=f'bytes=0-{length - 1}')['Body'].read()
     with open(audiofile_download_path, 'rb') as file_obj:
-        file_content = file_obj.read()
-        result = deepgram(file_content)
-        raw_transcript = 'null' if not (result) or result.strip() in ('', '.', 'null') else result
-    
-    final_llm_input = f"{raw_transcript}\n{CLEAN_SYSTEM_PROMPT}"
-    # logger.info(f'final_llm_input\n{final_llm_input}')
-    
-    clean_transcript = together(CLEAN_MODEL, None, final_llm_input)
+        return file_obj.read(length)
+
+def streaming_file(audiofile_download_path):
+    with open(audiofile_download_path, 'rb') as file_obj:
+        while True:
+            chunk = file_obj.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def reading_audio_bytes(bucket_name, object_key, audiofile_download_path):
+    if audiofile_download_path is None:
+        return b''.join(streaming_s3_object(bucket_name, object_key))
+    with open(audiofile_download_path, 'rb') as file_obj:
+        return file_obj.read()
+
+def removing_downloaded_audio_file(audiofile_download_path):
+    if audiofile_download_path and os.path.exists(audiofile_download_path):
+        os.remove(audiofile_download_path)
+        logger.info(f"Removed downloaded audio file: {audiofile_download_path}")
+
+def transcribing_audio(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata, cleaned_audio_bytes=None, metrics=None):
+    logger.info(f'Starting processing audio..')
+
+    def transcribing():
+        header = cleaned_audio_bytes[:12] if cleaned_audio_bytes is not None else peeking_audio_header(bucket_name, final_object_key, audiofile_download_path)
+        content_type = sniffing_content_type(header)
+        logger.info(f"Sniffed content type: {content_type}")
+
+        # PCM audio is decoded once for the voice activity gate and the upload reduction,
+        # larger files than AUDIO_DECODE_MAX_BYTES keep streaming so memory stays bounded
+        audio_bytes = cleaned_audio_bytes
+        if audio_bytes is None and is_wav(header) and (VAD_ENABLED or STT_DOWNMIX_RESAMPLE):
+            content_length = os.path.getsize(audiofile_download_path) if audiofile_download_path else audiofile_s3obj.get('ContentLength', 0)
+            if content_length <= AUDIO_DECODE_MAX_BYTES:
+                audio_bytes = reading_audio_bytes(bucket_name, final_object_key, audiofile_download_path)
+            else:
+                logger.info(f"Streaming {content_length} byte WAV without voice activity gating or resampling")
+        samples = None
+        if audio_bytes is not None and is_wav(audio_bytes):
+            samples, sample_rate = decoding_wav_or_none(audio_bytes)
+        if samples is not None:
+            if metrics is not None:
+                metrics['AudioSeconds'] = round(len(samples) / sample_rate, 3)
+
+            # Gate on voice activity so silent files never reach the paid APIs
+            if VAD_ENABLED:
+                counting_vad('checked')
+                if not detecting_speech(samples, sample_rate):
+                    counting_vad('skipped')
+                    logger.info(f"No speech detected, skipping transcription")
+                    return None
+
+            if STT_DOWNMIX_RESAMPLE:
+                speech_samples, speech_rate = preparing_speech_samples(samples, sample_rate)
+                if speech_samples is not samples:
+                    audio_bytes = encoding_wav(speech_samples, speech_rate)
+                    logger.info(f"Downmixed/resampled upload from {samples.shape[1]}ch {sample_rate}Hz to {speech_samples.shape[1]}ch {speech_rate}Hz")
+            if metrics is not None:
+                metrics['UploadBytes'] = len(audio_bytes)
+
+        if CHUNKED_TRANSCRIPTION and is_wav(header):
+            return transcribing_in_segments(audio_bytes or reading_audio_bytes(bucket_name, final_object_key, audiofile_download_path))
+        if audio_bytes is not None:
+            return routing_backend_call('stt', audio_bytes, content_type=content_type)
+        # Pass factories so retried or hedged uploads each get their own stream
+        if audiofile_download_path is None:
+            return routing_backend_call('stt', lambda: streaming_s3_object(bucket_name, final_object_key), content_type=content_type)
+        return routing_backend_call('stt', lambda: streaming_file(audiofile_download_path), content_type=content_type)
+
+    # The ETag addresses the audio content, without it there is nothing safe to key on
+    audiofile_etag = audiofile_s3obj.get('ETag')
+    if audiofile_etag:
+        # In process cleaning changes the audio, so its flags are part of the content address
+        cleaning_flags = {flag: audiofile_metadata.get(flag) for flag in ('filtermusic', 'normalizeloudness', 'removesilence')} if cleaned_audio_bytes is not None else None
+        result = cached_result('transcript', (audiofile_etag, audiofile_s3obj.get('ContentLength'), STT_BACKENDS, json.dumps(DEEPGRAM_PARAMS, sort_keys=True), CHUNKED_TRANSCRIPTION, STT_DOWNMIX_RESAMPLE, STT_TARGET_SAMPLE_RATE, json.dumps(cleaning_flags, sort_keys=True)), transcribing)
+    else:
+        result = transcribing()
+    raw_transcript = 'null' if not (result) or result.strip() in ('', '.', 'null') else result
+
+    return raw_transcript
+
+def finalizing_transcript(raw_transcript):
+    clean_transcript = cleaning_transcript(raw_transcript)
     # logger.info(f'clean_transcript\n{clean_transcript}')
 
     # speaker_label_transcript = together(CLEAN_MODEL, null, f"{SPEAKER_LABEL_SYSTEM_PROMPT}\n{clean_transcript}")
     # logger.info(f'speaker_label_transcript\n{speaker_label_transcript}')
-    
-    final_transcript = clean_transcript.lower().strip()
-    if final_transcript not in {'', '.', 'null'}:
-        vector_id = vectorupsert(final_transcript, audiofile_metadata)
-    
+
+    return clean_transcript.lower().strip()
+
+def is_junk_transcript(final_transcript):
+    return final_transcript in {'', '.', 'null'}
+
+def estimating_tokens(text):
+    # Cheap character based estimate, close enough for budgeting without loading a tokenizer
+    return int(len(text) / CLEAN_CHARS_PER_TOKEN) + 1
+
+def splitting_oversized_text(text, window_tokens):
+    # Fall back to sentence then word boundaries for a single paragraph bigger than the window
+    pieces = re.split(r'(?<=[.!?])\s+', text)
+    if any(estimating_tokens(piece) > window_tokens for piece in pieces):
+        pieces = text.split()
+    windows = []
+    for piece in pieces:
+        if windows and estimating_tokens(f"{windows[-1]} {piece}") <= window_tokens:
+            windows[-1] = f"{windows[-1]} {piece}"
+        else:
+            windows.append(piece)
+    return windows
+
+def windowing_transcript(transcript, window_tokens=None):
+    window_tokens = window_tokens or CLEAN_WINDOW_TOKENS
+
+    # Deepgram paragraphs (and speaker turns) are separated by blank lines
+    paragraphs = [paragraph.strip() for paragraph in re.split(r'\n\s*\n', transcript) if paragraph.strip()]
+    windows = []
+    for paragraph in paragraphs:
+        if estimating_tokens(paragraph) > window_tokens:
+            windows.extend(splitting_oversized_text(paragraph, window_tokens))
+        elif windows and estimating_tokens(f"{windows[-1]}\n\n{paragraph}") <= window_tokens:
+            windows[-1] = f"{windows[-1]}\n\n{paragraph}"
+        else:
+            windows.append(paragraph)
+    return windows
+
+def cleaning_window(window):
+    final_llm_input = f"{window}\n{CLEAN_SYSTEM_PROMPT}"
+    # Leave room for the model to rewrite the whole window
+    max_tokens = min(CLEAN_MAX_OUTPUT_TOKENS, 2 * estimating_tokens(window) + 64)
+    return cached_result('clean', (LLM_BACKENDS, CLEAN_MODEL, GPT_MODEL, final_llm_input), lambda: routing_backend_call('llm', None, final_llm_input, max_tokens=max_tokens))
+
+def cleaning_transcript(raw_transcript):
+    # Nothing for the LLM to fix in an empty or near empty transcript
+    if raw_transcript == 'null' or len(raw_transcript.split()) < CLEAN_MIN_WORDS:
+        logger.info(f'Skipping LLM cleaning for short transcript')
+        return raw_transcript
+
+    windows = windowing_transcript(raw_transcript)
+    logger.info(f'Cleaning transcript in {len(windows)} window(s)')
+    if len(windows) == 1:
+        return cleaning_window(windows[0])
+
+    max_workers = max(1, min(CLEAN_MAX_WORKERS, len(windows)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        clean_windows = list(executor.map(cleaning_window, windows))
+
+    # Drop windows the model judged to be noise so they don't leak into the final text
+    clean_windows = [clean_window.strip() for clean_window in clean_windows if clean_window.strip() not in ('', '.', 'null')]
+    return "\n\n".join(clean_windows) if clean_windows else '.'
+
+def deleting_original_audio_file(bucket_name, initial_object_key, final_object_key):
+    # Only the remote cleaning Lambda writes a new object that supersedes the original
+    if final_object_key == initial_object_key:
+        return
+    get_s3().delete_object(Bucket=bucket_name, Key=initial_object_key)
+    logger.info(f"Deleted Initial Audio File S3 Object at {bucket_name}/{initial_object_key}")
+
 def delete_or_not_audio_file(bucket_name, final_object_key, audiofile_metadata):
     logger.info(f'Deletion...')
 
     # If user requested deletion of the S3 object
     if audiofile_metadata["saveaudiofiles"] == "false":
-        s3.delete_object(Bucket=bucket_name, Key=final_object_key)
+        get_s3().delete_object(Bucket=bucket_name, Key=final_object_key)
         logger.info(f"Deleted S3 object: {bucket_name}/{final_object_key}")
         return
     
     logger.info(f'Not Deleted!')
     return
 
-def clean_or_not_final_audio_path(event, bucket_name, initial_object_key, audiofile_metadata):
+def clean_or_not_final_audio_path(event, bucket_name, initial_object_key, audiofile_s3obj, audiofile_metadata, remote_cleaning=True):
     logger.info(f'Creating final audio file object key...')
 
     if audiofile_metadata["cleanaudio"] == "true":
         logger.info(f"Cleaning audio file...")
 
+        # Clean the samples in memory, keeping the original object in place,
+        # only WAV within AUDIO_DECODE_MAX_BYTES is read so other uploads never get downloaded twice
+        if AUDIO_CLEANING_BACKEND == 'local':
+            header = peeking_audio_header(bucket_name, initial_object_key, None)
+            if is_wav(header) and audiofile_s3obj.get('ContentLength', 0) <= AUDIO_DECODE_MAX_BYTES:
+                cleaned_audio_bytes = cleaning_audio_in_process(reading_audio_bytes(bucket_name, initial_object_key, None), audiofile_metadata)
+                if cleaned_audio_bytes is not None:
+                    return initial_object_key, cleaned_audio_bytes
+            logger.info(f"Audio is not decodable PCM WAV within {AUDIO_DECODE_MAX_BYTES} bytes, falling back to the audio cleaning Lambda")
+
+        if not AUDIO_CLEANING_LAMBDA_NAME:
+            logger.info(f"No audio cleaning Lambda configured, NOT cleaning audio file...")
+            return initial_object_key, None
+        # The cleaning Lambda writes a new object, re-indexing only reads the retained audio
+        if not remote_cleaning:
+            logger.info(f"Re-indexing, NOT invoking the audio cleaning Lambda...")
+            return initial_object_key, None
+
         # Make a copy of event and add audio cleaning parameters from app 
-        updated_event = event
+        updated_event = dict(event)
         updated_event['filtermusic'] = audiofile_metadata["filtermusic"]
         updated_event['normalizeloudness'] = audiofile_metadata["normalizeloudness"]
         updated_event['removesilence'] = audiofile_metadata["removesilence"]
 
         # Invoke Lambda B for audio cleaning
-        audio_cleaning_lambda_response = lam.invoke(
+        audio_cleaning_lambda_response = get_lambda().invoke(
             FunctionName=AUDIO_CLEANING_LAMBDA_NAME,
             InvocationType='RequestResponse',
             Payload=json.dumps(updated_event)
@@ -150,14 +1574,12 @@ def clean_or_not_final_audio_path(event, bucket_name, initial_object_key, audiof
         payload_content = payload_stream.read()
         payload_json = json.loads(payload_content)
         cleaned_audiofile_object_key = payload_json.get('body', '').replace("\"", "")
-        
-        s3.delete_object(Bucket=bucket_name, Key=initial_object_key)
-        logger.info(f"Deleted Initial Audio File S3 Object at {bucket_name}/{initial_object_key}")
 
-        return cleaned_audiofile_object_key
+        # The original is deleted by its own pipeline stage, alongside transcription
+        return cleaned_audiofile_object_key, None
 
     logger.info(f"NOT cleaning audio file...")
-    return initial_object_key
+    return initial_object_key, None
 
 def update_metadata_type(metadata, text):
     document = metadata
@@ -202,47 +1624,48 @@ def update_metadata_type(metadata, text):
     return document
 
 # STT APIs
-def deepgram(file_content):
-    url = "https://api.deepgram.com/v1/listen"
+def deepgram_response(file_content, content_type='audio/wav'):
+    url = DEEPGRAM_API_URL
     headers = {
         "Accept": "application/json",
-        "Content-Type": 'audio/wav',
+        "Content-Type": content_type,
         "Authorization": f"Token {DEEPGRAM_API_KEY}"
     }
-    params = {
-        'model': 'nova-2-general',
-        'version': 'latest',
-        # 'detect_language': 'true',
-        'language': 'en',
-        'diarize': 'true',
-        'smart_format': 'true',
-        'filler_words': 'true'
-    }
-    response = requests.post(url, params=params, headers=headers, data=file_content, timeout=300)
+    response = http_post('deepgram', url, params=DEEPGRAM_PARAMS, headers=headers, data=file_content)
     response_json = response.json()
     # logger.info(f"Deepgram API response_json: {response_json}\n")
 
+    return response_json
+def deepgram(file_content, content_type='audio/wav'):
+    response_json = deepgram_response(file_content, content_type)
+
     # Extract transcript if available, otherwise use default
     response_data = response_json['results']['channels'][0]['alternatives'][0]
     final_transcript = response_data.get('paragraphs', {}).get('transcript', response_data['transcript'])
     logger.info(f"Deepgram API final_transcript: {final_transcript}\n")
     
     return final_transcript
-def whisper(file_content):
-    response = openai_client.audio.translations.create(
+def whisper(file_content, content_type='audio/wav'):
+    # The SDK needs a named file object rather than a stream factory
+    if callable(file_content):
+        file_content = b''.join(file_content())
+    if isinstance(file_content, (bytes, bytearray)):
+        extension = {'audio/mp4': 'm4a', 'audio/mpeg': 'mp3', 'audio/ogg': 'ogg', 'audio/flac': 'flac', 'audio/webm': 'webm'}.get(content_type, 'wav')
+        file_content = (f'audio.{extension}', bytes(file_content))
+    response = calling_vendor('openai', lambda: get_openai_client().audio.translations.create(
         model = "whisper-1", 
         file = file_content, 
         # language = "en",
         prompt = WHISPER_PROMPT
-    )
+    ))
     transcript_text = response.text
     logger.info(f"Whisper API Response: {transcript_text}\n")
     return transcript_text
-def whisperv3(file_content):
-    API_URL = "https://api-inference.huggingface.co/models/openai/whisper-large-v3"
-    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
+def whisperv3(file_content, content_type='audio/wav'):
+    API_URL = HUGGINGFACE_API_URL
+    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}", "Content-Type": content_type}
 
-    response = requests.post(API_URL, headers=headers, data=file_content)
+    response = http_post('huggingface', API_URL, headers=headers, data=file_content)
     response_json = response.json()
     logger.info(f"Hugging Face Whisper v3 API response_json: {response_json}\n")
     final_transcript = response_json['text']
@@ -251,17 +1674,17 @@ def whisperv3(file_content):
     return final_transcript
 
 # LLM APIs
-def together(modelName, system_prompt, user_text):
+def together(modelName, system_prompt, user_text, max_tokens=1024):
     messages = [
         {"role": "user", "content": user_text}
     ]
     if system_prompt is not None:
         messages.insert(0, {"role": "system", "content": system_prompt})
 
-    url = "https://api.together.xyz/v1/chat/completions"
+    url = TOGETHER_API_URL
     payload = {
         "model": modelName,
-        "max_tokens": 1024,
+        "max_tokens": max_tokens,
         "temperature": 0.0,
         "messages": messages
     }
@@ -271,62 +1694,1039 @@ def together(modelName, system_prompt, user_text):
         "Authorization": f"Bearer {TOGETHER_API_KEY}"
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_post('together', url, json=payload, headers=headers)
     response_data = json.loads(response.text)
     assitant_text = response_data['choices'][0]['message']['content']
     logger.info(f"Together API assitant_text: {assitant_text}\n")
 
     return assitant_text
-def gpt(modelName, system_prompt, user_text):
+def gpt(modelName, system_prompt, user_text, max_tokens=None):
     messages = [
         {"role": "user", "content": user_text}
     ]
     if system_prompt is not None:
         messages.insert(0, {"role": "system", "content": system_prompt})
     
-    response = openai_client.chat.completions.create(
+    response = calling_vendor('openai', lambda: get_openai_client().chat.completions.create(
         model=modelName,
-        messages=messages
-    )
+        messages=messages,
+        max_tokens=max_tokens
+    ))
     assitant_text = response.choices[0].message.content
     logger.info(f"GPT API Response: {assitant_text}\n")
 
     return assitant_text
 
 # Vector DB Operations
-def vectorupsert(text, metadata):
+def embedding_text(text):
+    return cached_result('embedding', (EMBEDDING_MODEL, text), lambda: calling_vendor('openai', lambda: get_embeddings_model().embed_documents([text])[0]))
+def upserting_vector(vector_id, embedding, updated_metadata):
     logger.info(f"Upserting vector to Pinecone...")
 
-    # Initialize the Pinecone client
-    embedding = embeddings_model.embed_documents([text])
-    updated_metadata = update_metadata_type(metadata, text)
-    vector_id = str(uuid.uuid4())
-    index.upsert([
+    calling_vendor('pinecone', lambda: get_index().upsert([
         (
             vector_id,
-            embedding[0],
+            embedding,
             updated_metadata
         ),
-    ])
+    ]))
 
     logger.info(f"Upserted successfully!\n")
+def embedding_texts(texts):
+    # Cached texts are served locally, every miss goes out in one batched request
+    embeddings = {}
+    misses = []
+    for text in dict.fromkeys(texts):
+        entry = reading_result_cache('embedding', (EMBEDDING_MODEL, text)) if RESULT_CACHE_ENABLED else None
+        if entry is not None:
+            embeddings[text] = entry['value']
+        else:
+            misses.append(text)
+
+    if misses:
+        logger.info(f"Embedding {len(misses)} text(s) in one request")
+        miss_embeddings = calling_vendor('openai', lambda: get_embeddings_model().embed_documents(misses))
+        for text, embedding in zip(misses, miss_embeddings):
+            embeddings[text] = embedding
+            if RESULT_CACHE_ENABLED:
+                writing_result_cache('embedding', (EMBEDDING_MODEL, text), embedding)
+
+    return [embeddings[text] for text in texts]
+def upserting_vectors(vectors):
+    # Size bounded chunks, each chunk fails or succeeds on its own
+    outcomes = []
+    for chunk_start in range(0, len(vectors), PINECONE_UPSERT_BATCH_SIZE):
+        chunk = vectors[chunk_start:chunk_start + PINECONE_UPSERT_BATCH_SIZE]
+        try:
+            calling_vendor('pinecone', lambda: get_index().upsert(chunk))
+            outcomes.extend([None] * len(chunk))
+        except Exception as e:
+            logger.error(f"Error upserting {len(chunk)} vector(s): {e}")
+            outcomes.extend([e] * len(chunk))
+    logger.info(f"Upserted {outcomes.count(None)}/{len(vectors)} vector(s)")
+    return outcomes
+def vectorupsert(text, metadata, vector_id=None):
+    embedding = embedding_text(text)
+    updated_metadata = update_metadata_type(metadata, text)
+    vector_id = vector_id or str(uuid.uuid4())
+    upserting_vector(vector_id, embedding, updated_metadata)
 
     return vector_id
 # endregion 
 
+# region Vector Buffer
+# Write-behind buffer that embeds and upserts transcripts from concurrent records in batches
+vector_buffer = []
+vector_buffer_condition = threading.Condition()
+vector_buffer_flusher = None
+vector_buffer_producers = 0
+
+def registering_vector_producer():
+    # Records that may still add to the buffer, once none are left there is nothing to wait for
+    global vector_buffer_producers
+
+    with vector_buffer_condition:
+        vector_buffer_producers += 1
+    return {'active': True}
+
+def finishing_vector_producer(producer):
+    global vector_buffer_producers
+
+    with vector_buffer_condition:
+        if producer['active']:
+            producer['active'] = False
+            vector_buffer_producers -= 1
+            vector_buffer_condition.notify_all()
+
+def is_vector_buffer_due():
+    return len(vector_buffer) >= VECTOR_BUFFER_SIZE or (vector_buffer and vector_buffer_producers <= 0)
+
+def flushing_vectors(batch):
+    try:
+        embeddings = embedding_texts([item['text'] for item in batch])
+    except Exception as e:
+        for item in batch:
+            item['future'].set_exception(e)
+        return
+
+    vectors = [(item['vector_id'], embedding, item['metadata']) for item, embedding in zip(batch, embeddings)]
+    for item, outcome in zip(batch, upserting_vectors(vectors)):
+        if outcome is None:
+            item['future'].set_result(item['vector_id'])
+        else:
+            item['future'].set_exception(outcome)
+
+def taking_vector_batch():
+    batch = vector_buffer[:VECTOR_BUFFER_SIZE]
+    del vector_buffer[:VECTOR_BUFFER_SIZE]
+    return batch
+
+def flushing_aged_vectors():
+    # Background flusher for buffers that never fill up
+    while True:
+        with vector_buffer_condition:
+            while not vector_buffer:
+                vector_buffer_condition.wait()
+            age = time.time() - vector_buffer[0]['added_at']
+            if age < VECTOR_BUFFER_MAX_AGE and not is_vector_buffer_due():
+                vector_buffer_condition.wait(VECTOR_BUFFER_MAX_AGE - age)
+                continue
+            batch = taking_vector_batch()
+        flushing_vectors(batch)
+
+def buffering_vector(text, metadata, vector_id, producer=None):
+    global vector_buffer_flusher
+
+    future = Future()
+    with vector_buffer_condition:
+        if vector_buffer_flusher is None:
+            vector_buffer_flusher = threading.Thread(target=flushing_aged_vectors, daemon=True)
+            vector_buffer_flusher.start()
+        vector_buffer.append({'text': text, 'metadata': metadata, 'vector_id': vector_id, 'future': future, 'added_at': time.time()})
+        if producer is not None:
+            finishing_vector_producer(producer)
+        batch = taking_vector_batch() if is_vector_buffer_due() else None
+        vector_buffer_condition.notify_all()
+
+    # Size and last producer triggered flushes run on the caller's thread
+    if batch:
+        flushing_vectors(batch)
+    return future
+
+def flushing_vector_buffer():
+    # Called on handler exit so nothing is left behind when the container freezes
+    while True:
+        with vector_buffer_condition:
+            batch = taking_vector_batch()
+        if not batch:
+            return
+        flushing_vectors(batch)
+# endregion 
+
+# region Backends
+# Interchangeable STT and LLM backends routed by rolling latency and error rate
+backend_registry = {'stt': {}, 'llm': {}}
+backend_lock = threading.Lock()
+hedge_executor = ThreadPoolExecutor(max_workers=BACKEND_HEDGE_WORKERS)
+
+def registering_backend(kind, name, function):
+    backend_registry[kind][name] = {
+        'function': function,
+        'latencies': deque(maxlen=BACKEND_WINDOW),
+        'outcomes': deque(maxlen=BACKEND_WINDOW),
+    }
+
+def backend_health(kind, name):
+    import numpy as np
+
+    backend = backend_registry[kind][name]
+    with backend_lock:
+        latencies = list(backend['latencies'])
+        outcomes = list(backend['outcomes'])
+    error_rate = outcomes.count(False) / len(outcomes) if outcomes else 0.0
+    if len(latencies) < BACKEND_MIN_SAMPLES:
+        return {'samples': len(latencies), 'error_rate': error_rate, 'p50': None, 'p95': None}
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {'samples': len(latencies), 'error_rate': error_rate, 'p50': float(p50), 'p95': float(p95)}
+
+def ranking_backends(kind):
+    # Healthy before unhealthy, then fastest p50, backends without enough samples keep their configured order up front
+    configured = STT_BACKENDS if kind == 'stt' else LLM_BACKENDS
+    names = [name for name in configured if name in backend_registry[kind]]
+
+    def ranking(position_name):
+        position, name = position_name
+        health = backend_health(kind, name)
+        unhealthy = len(backend_registry[kind][name]['outcomes']) >= BACKEND_MIN_SAMPLES and health['error_rate'] > BACKEND_MAX_ERROR_RATE
+        return (unhealthy, health['p50'] if health['p50'] is not None else -1.0, position)
+
+    return [name for _, name in sorted(enumerate(names), key=ranking)]
+
+def calling_backend(kind, name, *args, **kwargs):
+    backend = backend_registry[kind][name]
+    call_start = time.time()
+    try:
+        result = backend['function'](*args, **kwargs)
+    except Exception:
+        with backend_lock:
+            backend['outcomes'].append(False)
+        emitting_metrics({'BackendError': 1}, {'BackendError': 'Count'}, {'Kind': kind, 'Backend': name})
+        raise
+    latency = time.time() - call_start
+    with backend_lock:
+        backend['latencies'].append(latency)
+        backend['outcomes'].append(True)
+    emitting_metrics({'BackendLatency': round(latency * 1000, 2), 'BackendError': 0}, {'BackendLatency': 'Milliseconds', 'BackendError': 'Count'}, {'Kind': kind, 'Backend': name})
+    return result
+
+def routing_backend_call(kind, *args, **kwargs):
+    ranked = ranking_backends(kind)
+    if not ranked:
+        raise RuntimeError(f"No {kind} backends configured")
+    primary, backups = ranked[0], ranked[1:]
+
+    # Without a backup there is nothing to hedge or fail over to
+    if not backups:
+        return calling_backend(kind, primary, *args, **kwargs)
+
+    hedge_delay = backend_health(kind, primary)['p95'] if BACKEND_HEDGING else None
+    hedge_deadline = time.time() + hedge_delay if hedge_delay is not None else None
+    futures = {hedge_executor.submit(calling_backend, kind, primary, *args, **kwargs): primary}
+    error = None
+
+    while futures:
+        timeout = max(0.0, hedge_deadline - time.time()) if hedge_deadline is not None else None
+        done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        # Past the primary's p95, fire a backup and keep whichever answers first
+        if not done:
+            backup = backups.pop(0)
+            logger.info(f"Hedging {kind} request from {primary} to {backup}")
+            futures[hedge_executor.submit(calling_backend, kind, backup, *args, **kwargs)] = backup
+            hedge_deadline = None
+            continue
+
+        for future in done:
+            name = futures.pop(future)
+            try:
+                return future.result()
+            except Exception as e:
+                logger.error(f"{kind} backend {name} failed: {e}")
+                error = e
+
+        # Fail over when every in-flight request has failed
+        if not futures and backups:
+            backup = backups.pop(0)
+            hedge_deadline = None
+            futures[hedge_executor.submit(calling_backend, kind, backup, *args, **kwargs)] = backup
+
+    raise error
+
+def reporting_backends():
+    return {
+        kind: {name: backend_health(kind, name) for name in backends}
+        for kind, backends in backend_registry.items()
+    }
+
+registering_backend('stt', 'deepgram', deepgram)
+registering_backend('stt', 'whisper', whisper)
+registering_backend('stt', 'whisperv3', whisperv3)
+registering_backend('llm', 'together', lambda system_prompt, user_text, max_tokens=1024: together(CLEAN_MODEL, system_prompt, user_text, max_tokens=max_tokens))
+registering_backend('llm', 'gpt', lambda system_prompt, user_text, max_tokens=None: gpt(GPT_MODEL, system_prompt, user_text, max_tokens=max_tokens))
+# endregion 
+
+# region Backfill
+# Re-embeds stored vectors or re-runs retained audio in resumable units, checkpointing after each one
+backfill_checkpoints = {}
+
+def backfill_checkpoint_path(name):
+    return os.path.join(BACKFILL_CHECKPOINT_DIR, f"{name}.json")
+
+def reading_backfill_checkpoint(name):
+    if BACKFILL_CHECKPOINT_BUCKET:
+        try:
+            response = get_s3().get_object(Bucket=BACKFILL_CHECKPOINT_BUCKET, Key=f"{BACKFILL_CHECKPOINT_PREFIX}{name}.json")
+        except get_s3().exceptions.NoSuchKey:
+            return {}
+        return json.loads(response['Body'].read())
+    if BACKFILL_CHECKPOINT_DIR:
+        try:
+            with open(backfill_checkpoint_path(name), 'r', encoding='utf-8') as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+    return json.loads(json.dumps(backfill_checkpoints.get(name, {})))
+
+def writing_backfill_checkpoint(name, checkpoint):
+    checkpoint['updated_at'] = time.time()
+    body = json.dumps(checkpoint)
+    if BACKFILL_CHECKPOINT_BUCKET:
+        get_s3().put_object(Bucket=BACKFILL_CHECKPOINT_BUCKET, Key=f"{BACKFILL_CHECKPOINT_PREFIX}{name}.json", Body=body.encode('utf-8'), ContentType='application/json')
+    elif BACKFILL_CHECKPOINT_DIR:
+        # Write then rename so an interrupted run never leaves a torn checkpoint
+        os.makedirs(BACKFILL_CHECKPOINT_DIR, exist_ok=True)
+        path = backfill_checkpoint_path(name)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as checkpoint_file:
+            checkpoint_file.write(body)
+        os.replace(f"{path}.tmp", path)
+    else:
+        backfill_checkpoints[name] = json.loads(body)
+
+def listing_backfill_partitions(start_date, end_date):
+    # One partition per day, matching the year/month/day metadata every upload carries
+    day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    last_day = datetime.strptime(end_date, '%Y-%m-%d').date()
+    partitions = []
+    while day <= last_day:
+        partitions.append({'year': day.year, 'month': day.month, 'day': day.day})
+        day += timedelta(days=1)
+    return partitions
+
+def backfill_partition_name(partition):
+    return f"{partition['year']:04d}-{partition['month']:02d}-{partition['day']:02d}"
+
+def querying_vector_ids(query_filter):
+    # Metadata filtered query with a flat probe vector, values and metadata are fetched afterwards
+    probe = [1 / EMBEDDING_DIMENSIONS ** 0.5] * EMBEDDING_DIMENSIONS
+    response = calling_vendor('pinecone', lambda: get_index().query(vector=probe, filter=query_filter, top_k=BACKFILL_QUERY_TOP_K))
+    return [match.id for match in response['matches']]
+
+def listing_partition_vector_ids(partition):
+    vector_ids = querying_vector_ids({field: {'$eq': value} for field, value in partition.items()})
+    if len(vector_ids) < BACKFILL_QUERY_TOP_K:
+        return vector_ids
+
+    # A saturated day is split by hour so nothing past top_k is missed
+    if 'hours' not in partition:
+        vector_ids = []
+        for hour in range(24):
+            vector_ids.extend(listing_partition_vector_ids(dict(partition, hours=hour)))
+    else:
+        logger.warning(f"Partition {partition} returned {len(vector_ids)} vector(s), raise BACKFILL_QUERY_TOP_K")
+    return vector_ids
+
+def fetching_vectors(vector_ids):
+    vectors = {}
+    for chunk_start in range(0, len(vector_ids), BACKFILL_FETCH_BATCH_SIZE):
+        chunk = vector_ids[chunk_start:chunk_start + BACKFILL_FETCH_BATCH_SIZE]
+        response = calling_vendor('pinecone', lambda: get_index().fetch(ids=chunk))
+        vectors.update(response['vectors'])
+    return vectors
+
+def reembedding_partition(partition):
+    stats = {'vectors': 0, 'skipped': 0, 'failed': 0}
+    documents = []
+    for vector_id, vector in fetching_vectors(listing_partition_vector_ids(partition)).items():
+        metadata = dict(vector.metadata or {})
+        text = metadata.get('text', '')
+        if is_junk_transcript(text):
+            stats['skipped'] += 1
+            continue
+        documents.append((vector_id, update_metadata_type(metadata, text)))
+
+    # Large embedding batches straight to the model, a backfill would only flood the result cache
+    for batch_start in range(0, len(documents), BACKFILL_EMBED_BATCH_SIZE):
+        batch = documents[batch_start:batch_start + BACKFILL_EMBED_BATCH_SIZE]
+        texts = [metadata['text'] for _, metadata in batch]
+        embeddings = calling_vendor('openai', lambda: get_embeddings_model().embed_documents(texts))
+        outcomes = upserting_vectors([(vector_id, embedding, metadata) for (vector_id, metadata), embedding in zip(batch, embeddings)])
+        stats['vectors'] += len(batch)
+        stats['failed'] += len([outcome for outcome in outcomes if outcome is not None])
+    return stats
+
+def backfilling_vectors(name, checkpoint, start_date, end_date, deadline):
+    completed = set(checkpoint.setdefault('completed', []))
+    pending = [partition for partition in listing_backfill_partitions(start_date, end_date) if backfill_partition_name(partition) not in completed]
+    logger.info(f"Backfilling {len(pending)} partition(s), {len(completed)} already done")
+
+    checkpoint_lock = threading.Lock()
+    def running_partition(partition):
+        # Partitions not yet started when the time budget runs out are left for the next run
+        if deadline is not None and time.time() > deadline:
+            return False
+        try:
+            stats = reembedding_partition(partition)
+        except Exception as e:
+            logger.error(f"Error backfilling {backfill_partition_name(partition)}: {e}", exc_info=True)
+            return False
+        with checkpoint_lock:
+            for stat, value in stats.items():
+                checkpoint[stat] = checkpoint.get(stat, 0) + value
+            # A partition with failed upserts stays pending and is redone in full next run
+            if not stats['failed']:
+                checkpoint['completed'].append(backfill_partition_name(partition))
+            writing_backfill_checkpoint(name, checkpoint)
+        logger.info(f"Backfilled {backfill_partition_name(partition)}: {json.dumps(stats)}")
+        return not stats['failed']
+
+    with ThreadPoolExecutor(max_workers=max(1, BACKFILL_MAX_WORKERS)) as executor:
+        finished = list(executor.map(running_partition, pending))
+    return all(finished)
+
+def reindexing_objects(bucket_name, objects):
+    # Listing ETags are quoted, notification ETags are not
+    object_details = [
+        ({'s3': {'bucket': {'name': bucket_name}, 'object': {'key': item['Key'], 'eTag': item['ETag'].strip('"')}}}, bucket_name, item['Key'])
+        for item in objects
+    ]
+    results = process_records({'Records': [record for record, _, _ in object_details]}, object_details, reindexing=True, max_workers=BACKFILL_MAX_WORKERS)
+    flushing_vector_buffer()
+
+    failed_keys = {result['key'] for result in results if result['status'] == 'failure'}
+    return [{'Key': item['Key'], 'ETag': item['ETag']} for item in objects if item['Key'] in failed_keys]
+
+def backfilling_audio(name, checkpoint, bucket_name, prefix, deadline):
+    # Objects that failed on an earlier page stay pending and are retried first on every resume
+    failed_objects = checkpoint.get('failed_objects', [])
+    if failed_objects and (deadline is None or time.time() < deadline):
+        checkpoint['failed_objects'] = reindexing_objects(bucket_name, failed_objects)
+        writing_backfill_checkpoint(name, checkpoint)
+        logger.info(f"Retried {len(failed_objects)} failed object(s), {len(checkpoint['failed_objects'])} still failing")
+
+    # Pages are taken in key order so the last key of a finished page is the resume point
+    while deadline is None or time.time() < deadline:
+        list_kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': BACKFILL_PAGE_SIZE}
+        if checkpoint.get('start_after'):
+            list_kwargs['StartAfter'] = checkpoint['start_after']
+        page = get_s3().list_objects_v2(**list_kwargs)
+        objects = page.get('Contents', [])
+        if not objects:
+            return not checkpoint.get('failed_objects')
+
+        failed_objects = reindexing_objects(bucket_name, objects)
+        checkpoint['objects'] = checkpoint.get('objects', 0) + len(objects)
+        checkpoint['failed'] = checkpoint.get('failed', 0) + len(failed_objects)
+        checkpoint['failed_objects'] = checkpoint.get('failed_objects', []) + failed_objects
+        checkpoint['start_after'] = objects[-1]['Key']
+        writing_backfill_checkpoint(name, checkpoint)
+        logger.info(f"Backfilled {len(objects)} object(s) up to {checkpoint['start_after']} with {len(failed_objects)} failure(s)")
+    return False
+# endregion 
+
+# region Sweeper
+# Finds junk, near empty and duplicate vectors, then deletes them in bounded parallel batches
+def text_fingerprint(metadata, text):
+    # Same words from the same user count as a duplicate regardless of case and spacing
+    normalized = ' '.join(text.lower().split())
+    return hashlib.sha256(f"{metadata.get('username', '')}\n{normalized}".encode('utf-8')).hexdigest()
+
+def scanning_partition(partition):
+    scanned, short_ids, fingerprints = 0, [], {}
+    for vector_id, vector in fetching_vectors(listing_partition_vector_ids(partition)).items():
+        scanned += 1
+        metadata = vector.metadata or {}
+        text = str(metadata.get('text', '')).strip()
+        if is_junk_transcript(text) or len(text.split()) < SWEEP_MIN_WORDS:
+            short_ids.append(vector_id)
+            continue
+        fingerprints.setdefault(text_fingerprint(metadata, text), []).append((str(metadata.get('currenttimeformattedstring', '')), vector_id))
+    return scanned, short_ids, fingerprints
+
+def deleting_vectors(vector_ids):
+    chunks = [vector_ids[chunk_start:chunk_start + SWEEP_DELETE_BATCH_SIZE] for chunk_start in range(0, len(vector_ids), SWEEP_DELETE_BATCH_SIZE)]
+    def deleting_chunk(chunk):
+        try:
+            calling_vendor('pinecone', lambda: get_index().delete(ids=chunk))
+            return len(chunk), 0
+        except Exception as e:
+            logger.error(f"Error deleting {len(chunk)} vector(s): {e}")
+            return 0, len(chunk)
+
+    if not chunks:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=max(1, min(SWEEP_MAX_WORKERS, len(chunks)))) as executor:
+        outcomes = list(executor.map(deleting_chunk, chunks))
+    return sum(deleted for deleted, _ in outcomes), sum(failed for _, failed in outcomes)
+
+def sweeping_junk_vectors(dry_run):
+    # Exact junk texts are matched server side, so undated vectors are caught too
+    junk_ids, deleted, failed = [], 0, 0
+    while True:
+        vector_ids = querying_vector_ids({'text': {'$in': SWEEP_JUNK_TEXTS}})
+        junk_ids.extend(vector_ids)
+        if dry_run or not vector_ids:
+            break
+        page_deleted, page_failed = deleting_vectors(vector_ids)
+        deleted, failed = deleted + page_deleted, failed + page_failed
+        # Only a full page can have more behind it, and a page that failed to delete would come back forever
+        if page_failed or len(vector_ids) < BACKFILL_QUERY_TOP_K:
+            break
+    return junk_ids, deleted, failed
+
+def sweeping_vectors(start_date, end_date, dry_run):
+    junk_ids, deleted, failed = sweeping_junk_vectors(dry_run)
+    swept_ids = set(junk_ids)
+
+    partitions = listing_backfill_partitions(start_date, end_date)
+    with ThreadPoolExecutor(max_workers=max(1, SWEEP_MAX_WORKERS)) as executor:
+        scans = list(executor.map(scanning_partition, partitions))
+
+    short_ids = [vector_id for _, partition_short_ids, _ in scans for vector_id in partition_short_ids if vector_id not in swept_ids]
+    swept_ids.update(short_ids)
+
+    # The earliest copy of each duplicated text is kept
+    fingerprints = {}
+    for _, _, partition_fingerprints in scans:
+        for fingerprint, copies in partition_fingerprints.items():
+            fingerprints.setdefault(fingerprint, []).extend(copies)
+    duplicate_ids = [vector_id for copies in fingerprints.values() for _, vector_id in sorted(copies)[1:] if vector_id not in swept_ids]
+
+    if not dry_run:
+        sweep_deleted, sweep_failed = deleting_vectors(short_ids + duplicate_ids)
+        deleted, failed = deleted + sweep_deleted, failed + sweep_failed
+
+    return {
+        'scanned': sum(scanned for scanned, _, _ in scans),
+        'junk': len(junk_ids),
+        'short': len(short_ids),
+        'duplicates': len(duplicate_ids),
+        'deleted': deleted,
+        'failed': failed,
+        'sample': (junk_ids + short_ids + duplicate_ids)[:20],
+    }
+# endregion 
+
+# region Search
+# Read path over the typed metadata update_metadata_type writes, query embeddings stay warm in an LRU
+query_embedding_cache = OrderedDict()
+query_embedding_lock = threading.Lock()
+
+def embedding_queries(texts):
+    embeddings, misses = {}, []
+    with query_embedding_lock:
+        for text in dict.fromkeys(texts):
+            embedding = query_embedding_cache.get((EMBEDDING_MODEL, text))
+            if embedding is not None:
+                query_embedding_cache.move_to_end((EMBEDDING_MODEL, text))
+                embeddings[text] = embedding
+            else:
+                misses.append(text)
+
+    # Every miss in the request goes out in one batched embedding call
+    if misses:
+        miss_embeddings = calling_vendor('openai', lambda: get_embeddings_model().embed_documents(misses))
+        with query_embedding_lock:
+            for text, embedding in zip(misses, miss_embeddings):
+                embeddings[text] = embedding
+                query_embedding_cache[(EMBEDDING_MODEL, text)] = embedding
+                query_embedding_cache.move_to_end((EMBEDDING_MODEL, text))
+            while len(query_embedding_cache) > SEARCH_EMBEDDING_CACHE_SIZE:
+                query_embedding_cache.popitem(last=False)
+
+    return embeddings, set(misses)
+
+def date_range_filter(start_date, end_date):
+    # One clause per month, whole months drop the day constraint
+    day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    last_day = datetime.strptime(end_date, '%Y-%m-%d').date()
+    months = OrderedDict()
+    while day <= last_day:
+        months.setdefault((day.year, day.month), []).append(day.day)
+        day += timedelta(days=1)
+
+    clauses = []
+    for (year, month), days in months.items():
+        clause = {'year': {'$eq': year}, 'month': {'$eq': month}}
+        month_length = (datetime(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
+        if len(days) < month_length:
+            clause['day'] = {'$in': days}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+def building_search_filter(query):
+    # Structured constraints become server side metadata filters so less of the index is scanned
+    clauses = []
+    if query.get('username'):
+        clauses.append({'username': {'$eq': query['username']}})
+    if query.get('start_date') or query.get('end_date'):
+        start_date = query.get('start_date') or query['end_date']
+        end_date = query.get('end_date') or datetime.utcnow().strftime('%Y-%m-%d')
+        # An inverted range would become an empty $or that Pinecone rejects with an opaque error
+        if datetime.strptime(start_date, '%Y-%m-%d') > datetime.strptime(end_date, '%Y-%m-%d'):
+            raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+        clauses.append(date_range_filter(start_date, end_date))
+    if query.get('start_hour') is not None:
+        clauses.append({'hours': {'$gte': int(query['start_hour'])}})
+    if query.get('end_hour') is not None:
+        clauses.append({'hours': {'$lte': int(query['end_hour'])}})
+    if query.get('address'):
+        addresses = query['address'] if isinstance(query['address'], list) else [query['address']]
+        clauses.append({'address': {'$in': [urllib.parse.unquote(address, encoding='utf-8') for address in addresses]}})
+    if query.get('filter'):
+        clauses.append(query['filter'])
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+def searching_query(query, embedding, query_filter):
+    top_k = max(1, min(int(query.get('top_k', SEARCH_TOP_K)), SEARCH_MAX_TOP_K))
+    query_start = time.time()
+    response = calling_vendor('pinecone', lambda: get_index().query(vector=embedding, filter=query_filter, top_k=top_k, include_metadata=True))
+    query_duration = round((time.time() - query_start) * 1000, 2)
+    matches = [{'id': match.id, 'score': match.score, 'metadata': match.metadata} for match in response['matches']]
+    return matches, query_filter, query_duration
+
+def searching_memories(queries):
+    # Filters are built first so a bad query fails before anything is embedded
+    query_filters = [building_search_filter(query) for query in queries]
+    embed_start = time.time()
+    embeddings, embedded = embedding_queries([query['text'] for query in queries])
+    embed_duration = round((time.time() - embed_start) * 1000, 2)
+
+    # Queries fan out in parallel, each reports its own latency
+    with ThreadPoolExecutor(max_workers=max(1, min(SEARCH_MAX_WORKERS, len(queries)))) as executor:
+        futures = [executor.submit(searching_query, query, embeddings[query['text']], query_filter) for query, query_filter in zip(queries, query_filters)]
+        results = []
+        for query, future in zip(queries, futures):
+            matches, query_filter, query_duration = future.result()
+            cached = query['text'] not in embedded
+            results.append({
+                'text': query['text'],
+                'filter': query_filter,
+                'matches': matches,
+                'cached_embedding': cached,
+                'latency_ms': {
+                    'embed': 0 if cached else embed_duration,
+                    'query': query_duration,
+                    'total': (0 if cached else embed_duration) + query_duration,
+                },
+            })
+    return results
+# endregion 
+
+# region Warm Up
+# Builds every client and opens pooled connections ahead of the first real file on a new container
+def is_warmup_event(event):
+    # An explicit ping, or an EventBridge schedule pointed at the handler
+    return bool(event.get('warmup')) or event.get('detail-type') == 'Scheduled Event'
+
+def warming_http_vendor(vendor, url, headers):
+    # Concurrent HEAD requests leave that many keep-alive connections in the vendor pool, the status does not matter
+    http_session = get_http_session(vendor)
+    connections = max(1, min(WARMUP_CONNECTIONS, HTTP_POOL_SIZE))
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        responses = list(executor.map(lambda _: http_session.head(url, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_CONNECT_TIMEOUT)), range(connections)))
+    return responses[0].status_code
+
+def warming_s3():
+    if WARMUP_S3_BUCKET:
+        return get_s3().head_bucket(Bucket=WARMUP_S3_BUCKET)['ResponseMetadata']['HTTPStatusCode']
+    return len(get_s3().list_buckets()['Buckets'])
+
+def warming_openai():
+    get_openai_client()
+    return len(calling_vendor('openai', lambda: get_embeddings_model().embed_documents(['ping']))[0])
+
+def warming_numpy():
+    import numpy as np
+    return np.__version__
+
+warmup_targets = {
+    's3': (lambda: True, warming_s3),
+    # The local backend still falls back to the cleaning Lambda for non-WAV uploads
+    'lambda': (lambda: AUDIO_CLEANING_LAMBDA_NAME, lambda: get_lambda().get_function_configuration(FunctionName=AUDIO_CLEANING_LAMBDA_NAME)['State']),
+    'dynamodb': (lambda: LEDGER_TABLE_NAME, lambda: get_dynamodb().describe_table(TableName=LEDGER_TABLE_NAME)['Table']['TableStatus']),
+    'deepgram': (lambda: 'deepgram' in STT_BACKENDS, lambda: warming_http_vendor('deepgram', DEEPGRAM_API_URL, {'Authorization': f'Token {DEEPGRAM_API_KEY}'})),
+    'together': (lambda: 'together' in LLM_BACKENDS, lambda: warming_http_vendor('together', TOGETHER_API_URL, {'Authorization': f'Bearer {TOGETHER_API_KEY}'})),
+    'huggingface': (lambda: 'whisperv3' in STT_BACKENDS, lambda: warming_http_vendor('huggingface', HUGGINGFACE_API_URL, {'Authorization': f'Bearer {HUGGINGFACE_API_KEY}'})),
+    'openai': (lambda: True, warming_openai),
+    'pinecone': (lambda: True, lambda: get_index().describe_index_stats()['dimension']),
+    'numpy': (lambda: True, warming_numpy),
+}
+
+def warming_up(targets=None):
+    # Targets that are not configured for this deployment are skipped, a failing one never fails the ping
+    names = [name for name in (targets or WARMUP_TARGETS) if name in warmup_targets and warmup_targets[name][0]()]
+    timings, results, errors = {}, {}, {}
+    def warming(name):
+        warm_start = time.time()
+        try:
+            results[name] = warmup_targets[name][1]()
+        except Exception as e:
+            logger.error(f"Error warming {name}: {e}")
+            errors[name] = str(e)
+        timings[name] = round(time.time() - warm_start, 4)
+
+    if names:
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            list(executor.map(warming, names))
+    return timings, results, errors
+# endregion 
+
 # region Main
+def process_record(event, record, bucket_name, initial_object_key, reindexing=False):
+    # Single record copy of the event so the cleaning Lambda only sees this object
+    record_event = dict(event)
+    record_event['Records'] = [record]
+
+    key = ledger_key(record, bucket_name, initial_object_key)
+    # Backfills re-run objects the ledger already marked done, the deterministic ID overwrites in place
+    if not reindexing and not claiming_ledger(key):
+        logger.info(f"Skipping duplicate delivery of {key}")
+        return 'duplicate'
+
+    vector_id = deterministic_vector_id(vector_key(record, bucket_name, initial_object_key))
+    record_metrics = {'timings': {}, 'Bucket': bucket_name, 'Key': initial_object_key, 'ColdStart': int(cold_start), 'started_at': time.time()}
+
+    def audio(results):
+        audiofile_s3obj, final_object_key, audiofile_download_path, audiofile_metadata, cleaned_audio_bytes = downloading_s3_objects(record_event, bucket_name, initial_object_key, remote_cleaning=not reindexing)
+        record_metrics['AudioBytes'] = audiofile_s3obj.get('ContentLength', 0)
+        return {
+            'audiofile_s3obj': audiofile_s3obj,
+            'final_object_key': final_object_key,
+            'audiofile_download_path': audiofile_download_path,
+            'audiofile_metadata': audiofile_metadata,
+            'cleaned_audio_bytes': cleaned_audio_bytes,
+        }
+    def delete_original(results):
+        deleting_original_audio_file(bucket_name, initial_object_key, results['audio']['final_object_key'])
+    def metadata(results):
+        # Coerce a copy so the deletion stage keeps reading the raw S3 metadata
+        return update_metadata_type(dict(results['audio']['audiofile_metadata']), '')
+    def transcript(results):
+        return transcribing_audio(bucket_name, metrics=record_metrics, **results['audio'])
+    def delete(results):
+        delete_or_not_audio_file(bucket_name, results['audio']['final_object_key'], results['audio']['audiofile_metadata'])
+    def final_transcript(results):
+        final_transcript = finalizing_transcript(results['transcript'])
+        # Estimated the same way the cleaning windows are budgeted
+        if results['transcript'] != 'null':
+            record_metrics['LlmInputTokens'] = estimating_tokens(results['transcript'])
+            record_metrics['LlmOutputTokens'] = estimating_tokens(final_transcript)
+        return final_transcript
+    def upsert(results):
+        if is_junk_transcript(results['final_transcript']):
+            return
+        updated_metadata = dict(results['metadata'], text=results['final_transcript'])
+        if VECTOR_BUFFER_ENABLED:
+            # Wait on this record's own outcome so a failed batch item is retried individually
+            buffering_vector(results['final_transcript'], updated_metadata, vector_id, vector_producer).result()
+        else:
+            upserting_vector(vector_id, embedding_text(results['final_transcript']), updated_metadata)
+
+    stages = [
+        pipeline_stage('audio', audio),
+        pipeline_stage('metadata', metadata, ('audio',)),
+        pipeline_stage('transcript', transcript, ('audio',)),
+        pipeline_stage('final_transcript', final_transcript, ('transcript',)),
+        pipeline_stage('upsert', upsert, ('final_transcript', 'metadata')),
+    ]
+    # Audio is only deleted once the vector is stored, so a failed record can be retried from the source,
+    # and a re-index never deletes the retained audio it is reading
+    if not reindexing:
+        stages.append(pipeline_stage('delete_original', delete_original, ('upsert',)))
+        stages.append(pipeline_stage('delete', delete, ('upsert',)))
+
+    results = {}
+    vector_producer = registering_vector_producer()
+    try:
+        running_stages(stages, results, record_metrics['timings'])
+    except Exception:
+        if not reindexing:
+            releasing_ledger(key)
+        emitting_record_metrics(record_metrics, 'failure')
+        raise
+    finally:
+        finishing_vector_producer(vector_producer)
+        if 'audio' in results:
+            removing_downloaded_audio_file(results['audio']['audiofile_download_path'])
+
+    if not reindexing:
+        completing_ledger(key)
+    emitting_record_metrics(record_metrics, 'success')
+    return 'success'
+
+def process_record_safely(event, record, bucket_name, initial_object_key, reindexing=False):
+    try:
+        status = process_record(event, record, bucket_name, initial_object_key, reindexing)
+        return {'bucket': bucket_name, 'key': initial_object_key, 'status': status}
+
+    except Exception as e:
+        logger.error(f'Error processing {bucket_name}/{initial_object_key}: {e}', exc_info=True)
+        return {'bucket': bucket_name, 'key': initial_object_key, 'status': 'failure', 'error': str(e)}
+
+def process_records(event, object_details, reindexing=False, max_workers=None):
+    if not object_details:
+        return []
+
+    # Fan out records over a bounded worker pool, keeping results in event order
+    max_workers = max(1, min(max_workers or MAX_RECORD_WORKERS, len(object_details)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(process_record_safely, event, record, bucket_name, initial_object_key, reindexing)
+            for record, bucket_name, initial_object_key in object_details
+        ]
+        return [future.result() for future in futures]
+
+def pulling_sqs_message_details(event):
+    logger.info(f'Pulling SQS Message Details...')
+
+    # Unwrap the S3 notification carried in each SQS message body
+    message_details = []
+    for message in event.get('Records', []):
+        message_id = message['messageId']
+        try:
+            s3_event = json.loads(message['body'])
+            if s3_event.get('Event') == 's3:TestEvent':
+                logger.info(f"Skipping S3 test event in message {message_id}")
+                s3_event = {'Records': []}
+            message_details.append((message_id, s3_event, pulling_s3_object_details(s3_event), None))
+        except Exception as e:
+            logger.error(f'Error parsing SQS message {message_id}: {e}', exc_info=True)
+            message_details.append((message_id, None, [], str(e)))
+
+    return message_details
+
+@profiling_handler('sqs_handler')
+def sqs_handler(event, context):
+    logger.info(f'Started SQS batch!')
+    invocation_start = time.time()
+    invocation_cold_start = cold_start
+    resetting_result_cache_stats()
+    resetting_vad_stats()
+
+    message_details = pulling_sqs_message_details(event)
+    failed_message_ids = [message_id for message_id, _, _, error in message_details if error is not None]
+
+    # Flatten every S3 record of every message onto the same worker pool
+    jobs = [
+        (message_id, s3_event, record, bucket_name, initial_object_key)
+        for message_id, s3_event, object_details, error in message_details if error is None
+        for record, bucket_name, initial_object_key in object_details
+    ]
+    if jobs:
+        max_workers = max(1, min(MAX_RECORD_WORKERS, len(jobs)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (message_id, executor.submit(process_record_safely, s3_event, record, bucket_name, initial_object_key))
+                for message_id, s3_event, record, bucket_name, initial_object_key in jobs
+            ]
+            for message_id, future in futures:
+                if future.result()['status'] == 'failure' and message_id not in failed_message_ids:
+                    failed_message_ids.append(message_id)
+    flushing_vector_buffer()
+
+    logger.info(f'Processed {len(message_details)} message(s) with {len(failed_message_ids)} failure(s)')
+    logger.info(f'Result cache: {json.dumps(result_cache_stats)}')
+    logger.info(f'Voice activity: {json.dumps(vad_stats)}')
+    logger.info(f'Backends: {json.dumps(reporting_backends())}')
+    logger.info(f'Vendor limits: {json.dumps(reporting_vendor_limits())}')
+    reporting_cold_start()
+    emitting_invocation_metrics('sqs_handler', invocation_start, invocation_cold_start, len(message_details), len(failed_message_ids))
+
+    # Only the failed messages go back to the queue
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
+
+@profiling_handler('handler')
 def handler(event, context):
     try:
         logger.info(f'Started!')
+        invocation_start = time.time()
+        invocation_cold_start = cold_start
+        resetting_result_cache_stats()
+        resetting_vad_stats()
+
+        if is_warmup_event(event):
+            timings, results, errors = warming_up(event.get('targets'))
+            logger.info(f'Warmed up {len(timings)} target(s) with {len(errors)} error(s): {json.dumps(timings)}')
+            reporting_cold_start()
+            emitting_invocation_metrics('warmup', invocation_start, invocation_cold_start, len(timings), len(errors))
+
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'Warm!',
+                    'cold_start': invocation_cold_start,
+                    'duration': round(time.time() - invocation_start, 4),
+                    'timings': timings,
+                    'results': results,
+                    'errors': errors,
+                    'cold_start_timings': cold_start_timings,
+                }, default=str)
+            }
+
+        object_details = pulling_s3_object_details(event)
+        results = process_records(event, object_details)
+        flushing_vector_buffer()
+        failed = [result for result in results if result['status'] == 'failure']
+        logger.info(f'Processed {len(results)} record(s) with {len(failed)} failure(s)')
+        logger.info(f'Backends: {json.dumps(reporting_backends())}')
+        reporting_cold_start()
+        emitting_invocation_metrics('handler', invocation_start, invocation_cold_start, len(results), len(failed))
+
+        return {
+            'statusCode': 400 if failed else 200,
+            'body': json.dumps({
+                'message': 'Processing complete!' if not failed else 'Processing completed with failures',
+                'succeeded': len(results) - len(failed),
+                'failed': len(failed),
+                'results': results,
+                'cache': result_cache_stats,
+                'vad': vad_stats,
+                'limits': reporting_vendor_limits(),
+            })
+        }
+
+    except Exception as e: 
+        logger.error(f'Error: {e}', exc_info=True)
+        
+        return {
+            'statusCode': 400,
+            'body': f'Error :(\n{e}'
+        }
+def backfill_handler(event, context):
+    try:
+        logger.info(f'Started backfill!')
+        invocation_start = time.time()
+        invocation_cold_start = cold_start
+
+        mode = event.get('mode', 'vectors')
+        name = event.get('name', f'{mode}-backfill')
+        checkpoint = {} if event.get('reset') else reading_backfill_checkpoint(name)
+        count_key = 'objects' if mode == 's3' else 'vectors'
+        processed_before = checkpoint.get(count_key, 0)
+
+        # Stop taking new work while there is still time to checkpoint, the caller re-invokes until complete
+        deadline = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = invocation_start + context.get_remaining_time_in_millis() / 1000 - BACKFILL_TIME_MARGIN_SECONDS
+        elif event.get('time_budget_seconds'):
+            deadline = invocation_start + float(event['time_budget_seconds'])
+
+        if mode == 'vectors':
+            end_date = event.get('end_date', datetime.utcnow().strftime('%Y-%m-%d'))
+            complete = backfilling_vectors(name, checkpoint, event['start_date'], end_date, deadline)
+        elif mode == 's3':
+            complete = backfilling_audio(name, checkpoint, event['bucket'], event.get('prefix', ''), deadline)
+        else:
+            raise ValueError(f"Unknown backfill mode {mode}")
+        checkpoint['complete'] = complete
+        writing_backfill_checkpoint(name, checkpoint)
+
+        processed = checkpoint.get(count_key, 0) - processed_before
+        elapsed = time.time() - invocation_start
+        throughput = round(processed / max(elapsed, 1e-6), 2)
+        logger.info(f'Backfill {name} {"complete" if complete else "paused"} after {processed} item(s) in {elapsed:.1f}s ({throughput}/s)')
+        logger.info(f'Vendor limits: {json.dumps(reporting_vendor_limits())}')
+        reporting_cold_start()
+        emitting_invocation_metrics('backfill_handler', invocation_start, invocation_cold_start, processed, checkpoint.get('failed', 0))
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Backfill complete!' if complete else 'Backfill paused, invoke again to resume',
+                'name': name,
+                'complete': complete,
+                'processed': processed,
+                'total': checkpoint.get(count_key, 0),
+                'failed': checkpoint.get('failed', 0),
+                'throughput': throughput,
+                'limits': reporting_vendor_limits(),
+            })
+        }
+
+    except Exception as e: 
+        logger.error(f'Error: {e}', exc_info=True)
+        
+        return {
+            'statusCode': 400,
+            'body': f'Error :(\n{e}'
+        }
+def sweeper_handler(event, context):
+    try:
+        logger.info(f'Started sweep!')
+        invocation_start = time.time()
+        invocation_cold_start = cold_start
+
+        # Dry run unless explicitly turned off, so a scheduled sweep only reports until trusted
+        dry_run = event.get('dry_run', SWEEP_DRY_RUN)
+        end_date = event.get('end_date', datetime.utcnow().strftime('%Y-%m-%d'))
+        start_date = event.get('start_date', (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=SWEEP_LOOKBACK_DAYS)).strftime('%Y-%m-%d'))
+        stats = sweeping_vectors(start_date, end_date, dry_run)
+
+        elapsed = max(time.time() - invocation_start, 1e-6)
+        stats['scanned_per_second'] = round(stats['scanned'] / elapsed, 2)
+        stats['deleted_per_second'] = round(stats['deleted'] / elapsed, 2)
+        logger.info(f'Sweep {start_date} to {end_date}{" (dry run)" if dry_run else ""}: {json.dumps(stats)}')
+        reporting_cold_start()
+        emitting_invocation_metrics('sweeper_handler', invocation_start, invocation_cold_start, stats['scanned'], stats['failed'])
+
+        return {
+            'statusCode': 400 if stats['failed'] else 200,
+            'body': json.dumps(dict(stats, message='Sweep complete!', dry_run=dry_run, start_date=start_date, end_date=end_date))
+        }
+
+    except Exception as e: 
+        logger.error(f'Error: {e}', exc_info=True)
+        
+        return {
+            'statusCode': 400,
+            'body': f'Error :(\n{e}'
+        }
+def search_handler(event, context):
+    try:
+        logger.info(f'Started search!')
+        invocation_start = time.time()
+        invocation_cold_start = cold_start
+
+        # A single query or a batch under 'queries', plain strings are accepted too
+        queries = event.get('queries') or [event]
+        queries = [{'text': query} if isinstance(query, str) else query for query in queries]
+        results = searching_memories(queries)
 
-        bucket_name, initial_object_key = pulling_s3_object_details(event)
-        audiofile_s3obj, final_object_key, audiofile_download_path, audiofile_metadata = downloading_s3_objects(event, bucket_name, initial_object_key)
-        start_processing(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata)
-        delete_or_not_audio_file(bucket_name, final_object_key, audiofile_metadata)
+        logger.info(f'Searched {len(results)} query(s): {json.dumps([result["latency_ms"] for result in results])}')
+        reporting_cold_start()
+        emitting_invocation_metrics('search_handler', invocation_start, invocation_cold_start, len(results), 0)
 
         return {
             'statusCode': 200,
-            'body': json.dumps('Processing complete!')
+            'body': json.dumps({
+                'results': results,
+                'latency_ms': round((time.time() - invocation_start) * 1000, 2),
+            }, default=str)
         }
 
     except Exception as e: 
@@ -336,4 +2736,4 @@ def handler(event, context):
             'statusCode': 400,
             'body': f'Error :(\n{e}'
         }
-# endregion 
\ No newline at end of file
+# endregion
\ No newline at end of file
@@ -0,0 +1,330 @@
+import os
+import io
+import sys
+import json
+import time
+import wave
+import random
+import argparse
+import threading
+import tracemalloc
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+VENDORS = ('deepgram', 'together', 'openai', 'pinecone')
+
+# region Stub Servers
+# One local HTTP server speaking the Deepgram, Together, OpenAI embeddings and Pinecone wire formats
+stub_config = {vendor: {'latency': 0.0, 'jitter': 0.0, 'error_rate': 0.0} for vendor in VENDORS}
+stub_calls = {vendor: 0 for vendor in VENDORS}
+stub_lock = threading.Lock()
+
+def reading_request_body(request):
+    # requests sends streamed uploads with chunked transfer encoding
+    if request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        body = io.BytesIO()
+        while True:
+            size = int(request.rfile.readline().strip().split(b';')[0], 16)
+            if size == 0:
+                request.rfile.readline()
+                break
+            body.write(request.rfile.read(size))
+            request.rfile.readline()
+        return body.getvalue()
+    return request.rfile.read(int(request.headers.get('Content-Length', 0)))
+
+def wav_duration(audio_bytes):
+    try:
+        with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except (wave.Error, EOFError):
+        return 0.0
+
+def deepgram_stub(body, payload):
+    # One word every half second, alternating speakers every five seconds
+    duration = wav_duration(payload)
+    words = [
+        {'word': f'word{i}', 'punctuated_word': f'word{i}', 'start': i * 0.5, 'end': i * 0.5 + 0.4, 'speaker': int(i * 0.5 // 5) % 2}
+        for i in range(int(duration * 2))
+    ]
+    transcript = ' '.join(word['word'] for word in words)
+    return {'results': {'channels': [{'alternatives': [{'transcript': transcript, 'paragraphs': {'transcript': transcript}, 'words': words}]}]}}
+
+def together_stub(body, payload):
+    user_text = body['messages'][-1]['content']
+    return {'choices': [{'message': {'content': user_text.split('\n')[0]}}], 'usage': {'prompt_tokens': len(user_text) // 4}}
+
+def openai_stub(body, payload):
+    return {'data': [{'index': i, 'embedding': [0.001 * (len(text) % 100)] * 1536} for i, text in enumerate(body['input'])]}
+
+def pinecone_stub(body, payload):
+    return {'upsertedCount': len(body['vectors'])}
+
+stub_routes = {
+    '/v1/listen': ('deepgram', deepgram_stub),
+    '/v1/chat/completions': ('together', together_stub),
+    '/v1/embeddings': ('openai', openai_stub),
+    '/vectors/upsert': ('pinecone', pinecone_stub),
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        payload = reading_request_body(self)
+        vendor, route = stub_routes.get(path, (None, None))
+        if route is None:
+            return self.responding(404, {'error': 'not found'})
+
+        config = stub_config[vendor]
+        with stub_lock:
+            stub_calls[vendor] += 1
+        time.sleep(max(0.0, config['latency'] + random.uniform(-config['jitter'], config['jitter'])))
+        if random.random() < config['error_rate']:
+            return self.responding(random.choice([429, 500, 503]), {'error': 'injected'})
+
+        body = json.loads(payload) if vendor != 'deepgram' else None
+        self.responding(200, route(body, payload))
+
+    def responding(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+def starting_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+# endregion
+
+# region Stub Clients
+# Thin stand-ins for the OpenAIEmbeddings and pinecone.Index objects the module caches
+class StubVendorError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'stub returned {status_code}')
+        self.status_code = status_code
+
+def posting_stub(lambda_function, vendor, url, body):
+    response = lambda_function.get_http_session(vendor).post(url, json=body, timeout=(5, 60))
+    if response.status_code >= 400:
+        raise StubVendorError(response.status_code)
+    return response.json()
+
+class StubEmbeddings:
+    def __init__(self, lambda_function, base_url):
+        self.lambda_function = lambda_function
+        self.base_url = base_url
+
+    def embed_documents(self, texts):
+        response = posting_stub(self.lambda_function, 'openai', f'{self.base_url}/v1/embeddings', {'input': texts, 'model': 'stub'})
+        return [item['embedding'] for item in sorted(response['data'], key=lambda item: item['index'])]
+
+class StubIndex:
+    def __init__(self, lambda_function, base_url):
+        self.lambda_function = lambda_function
+        self.base_url = base_url
+
+    def upsert(self, vectors):
+        body = {'vectors': [{'id': vector_id, 'values': values, 'metadata': metadata} for vector_id, values, metadata in vectors]}
+        return posting_stub(self.lambda_function, 'pinecone', f'{self.base_url}/vectors/upsert', body)
+# endregion
+
+# region Corpus
+def generating_wav(seconds, sample_rate, speech, rng):
+    # Noise floor plus amplitude modulated tone bursts standing in for speech
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = rng.normal(0, 0.002, len(t))
+    if speech:
+        envelope = (np.sin(2 * np.pi * 0.5 * t) > 0).astype(np.float64)
+        audio += 0.3 * envelope * np.sin(2 * np.pi * 180 * t) * (1 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    samples = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def uploading_corpus(s3, bucket_name, args):
+    rng = np.random.default_rng(args.seed)
+    keys = []
+    for i in range(args.files):
+        key = f'recordings/benchmark_{i:05d}.wav'
+        speech = rng.random() >= args.silent_fraction
+        seconds = rng.uniform(args.min_seconds, args.max_seconds)
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=generating_wav(seconds, args.sample_rate, speech, rng),
+            Metadata={
+                'saveaudiofiles': 'true',
+                'cleanaudio': 'true' if rng.random() < args.clean_fraction else 'false',
+                'filtermusic': 'true',
+                'normalizeloudness': 'true',
+                'removesilence': 'true',
+                'username': 'benchmark',
+                'day': '1', 'month': '1', 'year': '2024', 'hours': '12', 'minutes': '0',
+            },
+        )
+        keys.append(key)
+    return keys
+
+def building_events(bucket_name, keys, batch_size):
+    events = []
+    for batch_start in range(0, len(keys), batch_size):
+        events.append({'Records': [
+            {'s3': {'bucket': {'name': bucket_name}, 'object': {'key': key, 'eTag': f'benchmark-{key}'}}}
+            for key in keys[batch_start:batch_start + batch_size]
+        ]})
+    return events
+# endregion
+
+# region Measurement
+def measuring_stage_memory(lambda_function, stage_peaks):
+    # Traced peak above the heap the stage started from, only meaningful while one stage runs at a time
+    timing_stage = lambda_function.timing_stage
+
+    def measured_timing_stage(stage, timings):
+        run = timing_stage(stage, timings)
+        def measured(results):
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            try:
+                return run(results)
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                stage_peaks.setdefault(stage['name'], []).append((peak - start) / 1e6)
+        return measured
+
+    return measured_timing_stage
+
+def profiling_memory(lambda_function, bucket_name, keys):
+    # Separate pass with one record and one stage in flight, so no stage is charged with another's buffers.
+    # The in-process stub server still allocates its copy of each request body during vendor calls.
+    stage_peaks = {}
+    lambda_function.ledger.clear()
+    tracemalloc.start()
+    try:
+        with patch.multiple(lambda_function, MAX_RECORD_WORKERS=1, STAGE_MAX_WORKERS=1, timing_stage=measuring_stage_memory(lambda_function, stage_peaks)):
+            for event in building_events(bucket_name, keys, 1):
+                lambda_function.handler(event, None)
+    finally:
+        tracemalloc.stop()
+    return stage_peaks
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2)}
+
+def summarizing(emitted, wall_seconds, files):
+    records = [record for record in emitted if 'Status' in record]
+    stage_durations = {}
+    for record in records:
+        for name, value in record.items():
+            if name.endswith('Duration') and name != 'TotalDuration':
+                stage_durations.setdefault(name[:-len('Duration')], []).append(value)
+
+    return {
+        'files': files,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_files_per_second': round(files / wall_seconds, 3) if wall_seconds else None,
+        'failures': sum(1 for record in records if record['Status'] != 'success'),
+        'total_ms': percentiles([record['TotalDuration'] for record in records]),
+        'stages_ms': {stage: percentiles(values) for stage, values in sorted(stage_durations.items())},
+        'stub_calls': dict(stub_calls),
+    }
+# endregion
+
+# region Main
+def parsing_vendor_values(values):
+    parsed = {}
+    for value in values or []:
+        vendor, number = value.split('=')
+        parsed[vendor] = float(number)
+    return parsed
+
+def parsing_args():
+    parser = argparse.ArgumentParser(description='Offline end to end benchmark of lambda_function.handler against local stand-ins')
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--batch-size', type=int, default=10, help='S3 records per handler event')
+    parser.add_argument('--min-seconds', type=float, default=5)
+    parser.add_argument('--max-seconds', type=float, default=30)
+    parser.add_argument('--sample-rate', type=int, default=16000)
+    parser.add_argument('--silent-fraction', type=float, default=0.2)
+    parser.add_argument('--clean-fraction', type=float, default=0.2)
+    parser.add_argument('--latency', action='append', help='vendor=seconds, e.g. deepgram=0.3')
+    parser.add_argument('--jitter', action='append', help='vendor=seconds')
+    parser.add_argument('--error-rate', action='append', help='vendor=fraction of 429/5xx responses')
+    parser.add_argument('--memory-files', type=int, default=10, help='files in the single worker memory pass')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write the JSON report to this path')
+    return parser.parse_args()
+
+def main():
+    args = parsing_args()
+    for name, values in (('latency', args.latency), ('jitter', args.jitter), ('error_rate', args.error_rate)):
+        for vendor, value in parsing_vendor_values(values).items():
+            stub_config[vendor][name] = value
+    server, base_url = starting_stub_server()
+
+    # The module reads its configuration at import, so point it at the stand-ins first
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'benchmark', 'AWS_SECRET_ACCESS_KEY': 'benchmark', 'AWS_DEFAULT_REGION': 'us-east-1',
+        'DEEPGRAM_API_URL': f'{base_url}/v1/listen',
+        'TOGETHER_API_URL': f'{base_url}/v1/chat/completions',
+        'RESULT_CACHE_ENABLED': 'false',
+        'CLEAN_SYSTEM_PROMPT': 'Clean this transcript.',
+        'HTTP_BACKOFF_BASE': os.environ.get('HTTP_BACKOFF_BASE', '0.05'),
+    })
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+    import lambda_function
+
+    emitted = []
+    lambda_function.metrics_sink = lambda line: emitted.append(json.loads(line))
+    lambda_function.client_cache['embeddings_model'] = StubEmbeddings(lambda_function, base_url)
+    lambda_function.client_cache['pinecone_index'] = StubIndex(lambda_function, base_url)
+
+    with mock_aws():
+        s3 = lambda_function.get_s3()
+        bucket_name = 'mia-audiofiles-benchmark'
+        s3.create_bucket(Bucket=bucket_name)
+        keys = uploading_corpus(s3, bucket_name, args)
+        events = building_events(bucket_name, keys, args.batch_size)
+
+        benchmark_start = time.time()
+        for event in events:
+            lambda_function.handler(event, None)
+        wall_seconds = time.time() - benchmark_start
+
+        report = summarizing(emitted, wall_seconds, len(keys))
+        report['vendor_limits'] = lambda_function.reporting_vendor_limits()
+        stage_peaks = profiling_memory(lambda_function, bucket_name, keys[:args.memory_files])
+        report['stage_peak_traced_mb'] = {stage: percentiles(peaks) for stage, peaks in sorted(stage_peaks.items())}
+
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
+# endregion
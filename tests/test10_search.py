@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+search_event = {
+    'queries': [
+        {'text': 'where did I leave my keys', 'username': 'nik', 'start_date': '2024-02-27', 'end_date': '2024-04-02', 'top_k': 3},
+        {'text': 'coffee with sam', 'start_hour': 8, 'end_hour': 11, 'address': 'Main%20Street'},
+        'where did I leave my keys',
+    ]
+}
+
+class StubEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+class StubIndex:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, vector, filter, top_k, include_metadata):
+        self.queries.append((filter, top_k))
+        return {'matches': [SimpleNamespace(id=f'vector-{n}', score=1 - n / 10, metadata={'text': 'memory'}) for n in range(top_k)]}
+
+def searching(event):
+    embeddings, index = StubEmbeddings(), StubIndex()
+    lambda_function.client_cache['embeddings_model'] = embeddings
+    lambda_function.client_cache['pinecone_index'] = index
+    try:
+        response = lambda_function.search_handler(event, None)
+    finally:
+        lambda_function.client_cache.pop('embeddings_model', None)
+        lambda_function.client_cache.pop('pinecone_index', None)
+    print(f'response: {response}')
+    return embeddings, index, json.loads(response['body'])
+
+def test_filters_and_batching():
+    lambda_function.query_embedding_cache.clear()
+    embeddings, index, body = searching(search_event)
+    assert embeddings.calls == [['where did I leave my keys', 'coffee with sam']]
+    assert [len(result['matches']) for result in body['results']] == [3, 5, 5]
+
+    date_filter = body['results'][0]['filter']['$and']
+    assert date_filter[0] == {'username': {'$eq': 'nik'}}
+    assert date_filter[1]['$or'] == [
+        {'year': {'$eq': 2024}, 'month': {'$eq': 2}, 'day': {'$in': [27, 28, 29]}},
+        {'year': {'$eq': 2024}, 'month': {'$eq': 3}},
+        {'year': {'$eq': 2024}, 'month': {'$eq': 4}, 'day': {'$in': [1, 2]}},
+    ]
+    assert body['results'][1]['filter']['$and'] == [
+        {'hours': {'$gte': 8}},
+        {'hours': {'$lte': 11}},
+        {'address': {'$in': ['Main Street']}},
+    ]
+    assert body['results'][2]['filter'] is None
+
+def test_query_embedding_cache():
+    lambda_function.query_embedding_cache.clear()
+    searching({'text': 'coffee with sam'})
+    embeddings, _, body = searching({'text': 'coffee with sam'})
+    assert embeddings.calls == []
+    assert body['results'][0]['cached_embedding']
+    assert body['results'][0]['latency_ms']['embed'] == 0
+
+def test_inverted_date_range():
+    embeddings, index = StubEmbeddings(), StubIndex()
+    with patch.dict(lambda_function.client_cache, embeddings_model=embeddings, pinecone_index=index):
+        response = lambda_function.search_handler({'text': 'coffee with sam', 'start_date': '2024-04-02', 'end_date': '2024-02-27'}, None)
+    print(f'response: {response}')
+    assert response['statusCode'] == 400
+    assert 'start_date 2024-04-02 is after end_date 2024-02-27' in response['body']
+    assert embeddings.calls == []
+    assert index.queries == []
+
+if __name__ == '__main__':
+    test_filters_and_batching()
+    test_query_embedding_cache()
+    test_inverted_date_range()
+    print(f'Search checks passed!')
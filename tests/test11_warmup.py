@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_HEAD(self):
+        StubHandler.connections.add(self.client_address)
+        self.send_response(405)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class StubS3:
+    def head_bucket(self, Bucket):
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+class StubEmbeddings:
+    def embed_documents(self, texts):
+        return [[0.0] * 8 for _ in texts]
+
+class StubIndex:
+    def describe_index_stats(self):
+        return {'dimension': 8}
+
+def test_warmup_event():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stubs = {'s3': StubS3(), 'openai': object(), 'embeddings_model': StubEmbeddings(), 'pinecone_index': StubIndex()}
+    lambda_function.client_cache.update(stubs)
+    deepgram_api_url, warmup_s3_bucket = lambda_function.DEEPGRAM_API_URL, lambda_function.WARMUP_S3_BUCKET
+    lambda_function.DEEPGRAM_API_URL = f'http://127.0.0.1:{server.server_address[1]}/v1/listen'
+    lambda_function.WARMUP_S3_BUCKET = 'mia-audiofiles'
+    try:
+        response = lambda_function.handler({'warmup': True, 'targets': ['s3', 'deepgram', 'openai', 'pinecone', 'numpy', 'dynamodb']}, None)
+    finally:
+        server.shutdown()
+        lambda_function.DEEPGRAM_API_URL, lambda_function.WARMUP_S3_BUCKET = deepgram_api_url, warmup_s3_bucket
+        for name in stubs:
+            lambda_function.client_cache.pop(name, None)
+        lambda_function.client_cache.pop('http_deepgram', None)
+
+    body = json.loads(response['body'])
+    print(f'body: {body}')
+    assert response['statusCode'] == 200
+    assert body['errors'] == {}
+    # The ledger table is not configured so DynamoDB is skipped
+    assert sorted(body['timings']) == ['deepgram', 'numpy', 'openai', 'pinecone', 's3']
+    assert body['results']['deepgram'] == 405
+    assert len(StubHandler.connections) == lambda_function.WARMUP_CONNECTIONS
+
+def test_cleaning_lambda_warms_with_local_backend():
+    configurations = []
+    stub_lambda = SimpleNamespace(get_function_configuration=lambda FunctionName: configurations.append(FunctionName) or {'State': 'Active'})
+    with patch.multiple(lambda_function, AUDIO_CLEANING_LAMBDA_NAME='audio-cleaning', AUDIO_CLEANING_BACKEND='local', get_lambda=lambda: stub_lambda):
+        timings, results, errors = lambda_function.warming_up(['lambda'])
+    assert results == {'lambda': 'Active'}
+    assert configurations == ['audio-cleaning']
+
+if __name__ == '__main__':
+    test_warmup_event()
+    test_cleaning_lambda_warms_with_local_backend()
+    print(f'Warm up checks passed!')
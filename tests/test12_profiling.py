@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import glob
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+test_event = {
+    'profile': True,
+    'Records': [
+        {
+            's3': {
+                'bucket': {'name': 'mia-audiofiles'},
+                'object': {'key': 'recordings/recording_206419037.m4a', 'eTag': '0cc175b9c0f1b6a831c399e269772661'}
+            }
+        }
+    ]
+}
+
+def stub_pipeline():
+    retained = []
+
+    def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
+        return {}, initial_object_key, None, {'saveaudiofiles': 'true'}, None
+    def transcribing_audio(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata, cleaned_audio_bytes=None, metrics=None):
+        # Something to show up as a hot function and a retained allocation site
+        retained.extend(bytearray(64 * 1024) for _ in range(32))
+        return 'null'
+    def delete_or_not_audio_file(bucket_name, final_object_key, audiofile_metadata):
+        pass
+
+    return patch.multiple(
+        lambda_function,
+        downloading_s3_objects=downloading_s3_objects,
+        transcribing_audio=transcribing_audio,
+        delete_or_not_audio_file=delete_or_not_audio_file,
+    )
+
+def test_profile_report():
+    lambda_function.ledger.clear()
+    with tempfile.TemporaryDirectory() as profiling_dir:
+        with stub_pipeline(), patch.object(lambda_function, 'PROFILING_DIR', profiling_dir):
+            response = lambda_function.handler(json.loads(json.dumps(test_event)), None)
+
+        paths = glob.glob(os.path.join(profiling_dir, 'handler', '*.json'))
+        assert len(paths) == 1
+        with open(paths[0], 'r', encoding='utf-8') as profile_file:
+            report = json.load(profile_file)
+
+    print(f"stages: {sorted(report['stages'])}")
+    print(f"transcript: {json.dumps(report['stages']['transcript'], indent=2)}")
+    assert response['statusCode'] == 200
+    assert report['peak_rss_mb'] > 0
+    assert {'invocation', 'audio', 'metadata', 'transcript', 'final_transcript', 'upsert'} <= set(report['stages'])
+    transcript = report['stages']['transcript']
+    assert any('transcribing_audio' in function['function'] for function in transcript['hot_functions'])
+    assert transcript['allocations'][0]['size_kb'] >= 1024
+    assert lambda_function.active_profile is None
+
+def test_profiling_is_opt_in():
+    assert not lambda_function.PROFILING_ENABLED
+    with lambda_function.profiling_invocation('handler', {}):
+        assert lambda_function.active_profile is None
+
+if __name__ == '__main__':
+    test_profile_report()
+    test_profiling_is_opt_in()
+    print(f'Profiling checks passed!')
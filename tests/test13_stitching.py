@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+import wave
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+SAMPLE_RATE = 1
+SEGMENT_SECONDS = 10
+OVERLAP_SECONDS = 2
+SEGMENTS = 6
+
+# Ground truth: two speakers taking 7 second turns, one word per second
+timeline = [(second, (second // 7) % 2, f'w{second}') for second in range(SEGMENTS * SEGMENT_SECONDS)]
+
+def segment_bounds():
+    total = SEGMENTS * SEGMENT_SECONDS
+    return [
+        (max(0, own_start - OVERLAP_SECONDS), min(total, own_start + SEGMENT_SECONDS + OVERLAP_SECONDS), own_start, own_start + SEGMENT_SECONDS)
+        for own_start in range(0, total, SEGMENT_SECONDS)
+    ]
+
+def segment_response(start, end, index):
+    # Every segment labels its speakers independently, odd segments swap the labels
+    words = [
+        {'word': text, 'start': second - start, 'end': second - start + 0.8, 'speaker': speaker ^ (index % 2)}
+        for second, speaker, text in timeline if start <= second < end
+    ]
+    return {'results': {'channels': [{'alternatives': [{'words': words}]}]}}
+
+def expected_transcript():
+    paragraphs = []
+    for _, speaker, text in timeline:
+        if paragraphs and paragraphs[-1][0] == speaker:
+            paragraphs[-1][1].append(text)
+        else:
+            paragraphs.append((speaker, [text]))
+    return "\n\n".join(f"Speaker {speaker}: {' '.join(texts)}" for speaker, texts in paragraphs)
+
+def test_two_speakers_keep_two_labels():
+    bounds = segment_bounds()
+    responses = [segment_response(start, end, index) for index, (start, end, _, _) in enumerate(bounds)]
+    stitched = lambda_function.stitching_segment_words(responses, bounds, SAMPLE_RATE)
+    print(f'stitched\n{stitched}')
+    assert {paragraph.split(':')[0] for paragraph in stitched.split('\n\n')} == {'Speaker 0', 'Speaker 1'}
+    assert stitched == expected_transcript()
+
+def test_new_speaker_gets_new_label():
+    known_speakers = {0: 10.0, 1: 9.0}
+    previous_words = [(9.0, 9.5, 0, 'hi')]
+    words = [(9.1, 9.4, 1, 'hi'), (11.0, 11.5, 0, 'there'), (12.0, 12.5, 2, 'friend')]
+    mapping = lambda_function.mapping_segment_speakers(previous_words, words, known_speakers)
+    assert mapping == {1: 0, 0: 1, 2: 2}
+
+def test_unsegmented_audio_is_routed():
+    routed = []
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(b'\x00\x00' * 16000)
+    with patch.object(lambda_function, 'routing_backend_call', lambda kind, file_content, content_type='audio/wav': routed.append((kind, content_type)) or 'hello'):
+        assert lambda_function.transcribing_in_segments(b'\x00\x00\x00\x20ftypM4A \x00\x00') == 'hello'
+        assert lambda_function.transcribing_in_segments(buffer.getvalue()) == 'hello'
+    assert routed == [('stt', 'audio/mp4'), ('stt', 'audio/wav')]
+
+if __name__ == '__main__':
+    test_two_speakers_keep_two_labels()
+    test_new_speaker_gets_new_label()
+    test_unsegmented_audio_is_routed()
+    print(f'Stitching checks passed!')
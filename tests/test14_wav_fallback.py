@@ -0,0 +1,120 @@
+import io
+import os
+import sys
+import wave
+import struct
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+SAMPLE_RATE = 48000
+FRAMES = SAMPLE_RATE // 2
+
+def pcm24_wav():
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(3)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(b'\x00\x10\x00' * 2 * FRAMES)
+    return buffer.getvalue()
+
+def header_only_wav(format_tag, bits, extra=b''):
+    # Hand built fmt chunk for the formats the stdlib writer cannot produce
+    channels = 2
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', format_tag, channels, SAMPLE_RATE, SAMPLE_RATE * block_align, block_align, bits) + extra
+    data = struct.pack('<f', 0.25) * channels * FRAMES if bits == 32 else b'\x00' * block_align * FRAMES
+    body = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def float_wav():
+    return header_only_wav(3, 32)
+
+def extensible_wav():
+    # cbSize, valid bits, channel mask and the PCM sub-format GUID
+    extra = struct.pack('<HHI', 22, 24, 3) + bytes.fromhex('0100000000001000800000aa00389b71')
+    return header_only_wav(65534, 24, extra)
+
+def transcribing(audio_bytes, audiofile_s3obj=None):
+    routed = []
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as audio_file:
+        audio_file.write(audio_bytes)
+    try:
+        with patch.object(lambda_function, 'routing_backend_call', lambda kind, file_content, content_type='audio/wav': routed.append((file_content, content_type)) or 'hello there friend'):
+            transcript = lambda_function.transcribing_audio('mia-audiofiles', 'recordings/upload.wav', audiofile_s3obj or {}, audio_file.name, {})
+    finally:
+        os.remove(audio_file.name)
+    return transcript, routed
+
+def test_undecodable_wavs_go_out_unchanged():
+    for name, audio_bytes in (('24-bit', pcm24_wav()), ('float', float_wav()), ('extensible', extensible_wav())):
+        transcript, routed = transcribing(audio_bytes)
+        print(f'{name}: {transcript}')
+        assert transcript == 'hello there friend'
+        assert routed == [(audio_bytes, 'audio/wav')]
+
+def test_large_wavs_keep_streaming():
+    # Silent 16-bit PCM would be skipped by the gate if it were read into memory
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(b'\x00\x00' * FRAMES)
+    with patch.object(lambda_function, 'AUDIO_DECODE_MAX_BYTES', 1024):
+        transcript, routed = transcribing(buffer.getvalue())
+    assert transcript == 'hello there friend'
+    assert callable(routed[0][0])
+
+def test_vad_skip_is_not_cached():
+    # A bad verdict must not outlive a threshold change through the durable cache
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(b'\x00\x00' * FRAMES)
+    audiofile_s3obj = {'ETag': '"silent"', 'ContentLength': len(buffer.getvalue())}
+    lambda_function.result_cache.clear()
+    with tempfile.TemporaryDirectory() as cache_dir, patch.multiple(lambda_function, RESULT_CACHE_ENABLED=True, RESULT_CACHE_BUCKET=None, RESULT_CACHE_DIR=cache_dir):
+        transcript, routed = transcribing(buffer.getvalue(), audiofile_s3obj)
+        assert (transcript, routed) == ('null', [])
+        assert os.listdir(cache_dir) == []
+
+        with patch.object(lambda_function, 'VAD_ENABLED', False):
+            transcript, routed = transcribing(buffer.getvalue(), audiofile_s3obj)
+        assert transcript == 'hello there friend'
+        assert len(routed) == 1
+    lambda_function.result_cache.clear()
+
+def test_in_process_cleaning_falls_back():
+    assert lambda_function.cleaning_audio_in_process(pcm24_wav(), {'normalizeloudness': 'true'}) is None
+
+def test_cleaning_reads_only_small_wavs():
+    # Non-WAV and oversized uploads go to the cleaning Lambda without being downloaded first
+    read = []
+    audiofile_metadata = {'cleanaudio': 'true', 'normalizeloudness': 'true'}
+    cases = (('m4a', b'\x00\x00\x00\x20ftypM4A ', 1024), ('large wav', b'RIFF\x00\x00\x00\x00WAVE', 2048))
+    for name, header, content_length in cases:
+        with patch.multiple(
+            lambda_function,
+            AUDIO_CLEANING_BACKEND='local',
+            AUDIO_CLEANING_LAMBDA_NAME=None,
+            AUDIO_DECODE_MAX_BYTES=1024,
+            peeking_audio_header=lambda bucket_name, object_key, download_path: header,
+            reading_audio_bytes=lambda *args: read.append(name),
+        ):
+            final_object_key, cleaned_audio_bytes = lambda_function.clean_or_not_final_audio_path({}, 'mia-audiofiles', 'recordings/upload', {'ContentLength': content_length}, audiofile_metadata)
+        assert (final_object_key, cleaned_audio_bytes) == ('recordings/upload', None)
+    assert read == []
+
+if __name__ == '__main__':
+    test_undecodable_wavs_go_out_unchanged()
+    test_large_wavs_keep_streaming()
+    test_vad_skip_is_not_cached()
+    test_in_process_cleaning_falls_back()
+    test_cleaning_reads_only_small_wavs()
+    print(f'WAV fallback checks passed!')
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+def installing_backends(backends, history):
+    # Stub LLM backends with a seeded latency history so ranking and p95 are known up front
+    configured = lambda_function.LLM_BACKENDS
+    lambda_function.LLM_BACKENDS = list(backends)
+    for name, function in backends.items():
+        lambda_function.registering_backend('llm', name, function)
+        latencies, outcomes = history[name]
+        lambda_function.backend_registry['llm'][name]['latencies'].extend(latencies)
+        lambda_function.backend_registry['llm'][name]['outcomes'].extend(outcomes)
+    return configured
+
+def removing_backends(backends, configured):
+    lambda_function.LLM_BACKENDS = configured
+    for name in backends:
+        lambda_function.backend_registry['llm'].pop(name, None)
+
+def test_hedge_fires_after_p95_and_first_answer_wins():
+    calls = []
+    released = threading.Event()
+    def slow(system_prompt, user_text):
+        calls.append(('slow', time.time()))
+        released.wait(2)
+        return 'slow answer'
+    def fast(system_prompt, user_text):
+        calls.append(('fast', time.time()))
+        return 'fast answer'
+
+    backends = {'slow': slow, 'fast': fast}
+    configured = installing_backends(backends, {'slow': ([0.1] * 10, [True] * 10), 'fast': ([0.2] * 10, [True] * 10)})
+    try:
+        assert lambda_function.ranking_backends('llm') == ['slow', 'fast']
+        call_start = time.time()
+        with patch.object(lambda_function, 'BACKEND_HEDGING', True):
+            result = lambda_function.routing_backend_call('llm', None, 'hello')
+        elapsed = time.time() - call_start
+    finally:
+        released.set()
+        removing_backends(backends, configured)
+
+    print(f'calls: {[(name, round(at - call_start, 3)) for name, at in calls]}, elapsed: {elapsed:.3f}s')
+    assert result == 'fast answer'
+    assert [name for name, _ in calls] == ['slow', 'fast']
+    # The backup waits for the primary's p95 and no longer
+    assert 0.09 <= calls[1][1] - call_start < 0.5
+    assert elapsed < 0.5
+
+def test_failing_primary_fails_over():
+    def broken(system_prompt, user_text):
+        raise RuntimeError('primary down')
+    def backup(system_prompt, user_text):
+        return 'backup answer'
+
+    backends = {'broken': broken, 'backup': backup}
+    configured = installing_backends(backends, {'broken': ([], []), 'backup': ([], [])})
+    try:
+        assert lambda_function.routing_backend_call('llm', None, 'hello') == 'backup answer'
+        assert list(lambda_function.backend_registry['llm']['broken']['outcomes']) == [False]
+        assert list(lambda_function.backend_registry['llm']['backup']['outcomes']) == [True]
+    finally:
+        removing_backends(backends, configured)
+
+def test_unhealthy_backend_ranks_last():
+    backends = {'flaky': lambda system_prompt, user_text: 'flaky', 'steady': lambda system_prompt, user_text: 'steady'}
+    configured = installing_backends(backends, {'flaky': ([0.01] * 10, [False] * 8 + [True] * 2), 'steady': ([0.5] * 10, [True] * 10)})
+    try:
+        assert lambda_function.ranking_backends('llm') == ['steady', 'flaky']
+        assert lambda_function.routing_backend_call('llm', None, 'hello') == 'steady'
+    finally:
+        removing_backends(backends, configured)
+
+if __name__ == '__main__':
+    test_hedge_fires_after_p95_and_first_answer_wins()
+    test_failing_primary_fails_over()
+    test_unhealthy_backend_ranks_last()
+    print(f'Backend routing checks passed!')
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+def installing_vendor(vendor, limits):
+    lambda_function.VENDOR_LIMITS[vendor] = limits
+    lambda_function.vendor_limiters.pop(vendor, None)
+    return lambda_function.get_vendor_limiter(vendor)
+
+def removing_vendor(vendor):
+    lambda_function.VENDOR_LIMITS.pop(vendor, None)
+    lambda_function.vendor_limiters.pop(vendor, None)
+
+def calling(vendor, outcome):
+    with lambda_function.limiting_vendor(vendor) as vendor_call:
+        vendor_call['outcome'] = outcome
+
+def test_aimd_halves_once_per_cooldown_and_regrows():
+    limiter = installing_vendor('test-aimd', {'rate': 1000, 'concurrency': 8, 'min_concurrency': 1, 'max_concurrency': 10})
+    try:
+        calling('test-aimd', 'throttled')
+        assert limiter['limit'] == 4
+        # A second 429 inside the cooldown does not halve again
+        calling('test-aimd', 'throttled')
+        assert limiter['limit'] == 4
+        limiter['decreased_at'] -= lambda_function.VENDOR_DECREASE_COOLDOWN
+        calling('test-aimd', 'throttled')
+        assert limiter['limit'] == 2
+        assert limiter['throttled'] == 3
+
+        # Additive increase of 1/limit per success, capped at the maximum
+        calling('test-aimd', 'success')
+        assert limiter['limit'] == 2.5
+        for _ in range(200):
+            calling('test-aimd', 'success')
+        assert limiter['limit'] == 10
+    finally:
+        removing_vendor('test-aimd')
+
+def test_failures_never_grow_the_limit():
+    limiter = installing_vendor('test-failures', {'rate': 1000, 'concurrency': 8, 'min_concurrency': 1, 'max_concurrency': 10})
+    class StubSession:
+        def __init__(self, outcomes):
+            self.outcomes = list(outcomes)
+        def post(self, url, data=None, timeout=None, **kwargs):
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return SimpleNamespace(status_code=outcome, headers={}, raise_for_status=lambda: None)
+    class APITimeoutError(Exception):
+        pass
+    class BadRequestError(Exception):
+        status_code = 400
+    def raising(error):
+        raise error
+    try:
+        # Retried 503s and timeouts halve once, then hold through the cooldown instead of growing
+        session = StubSession([503, lambda_function.requests.Timeout('read timed out'), 503])
+        with patch.multiple(lambda_function, get_http_session=lambda vendor: session, HTTP_BACKOFF_BASE=0.0, HTTP_MAX_RETRIES=2):
+            try:
+                lambda_function.http_post('test-failures', 'http://vendor.invalid')
+            except lambda_function.requests.HTTPError:
+                pass
+        assert limiter['limit'] == 4
+        assert (limiter['failed'], limiter['throttled']) == (3, 0)
+
+        for error in (APITimeoutError(), BadRequestError()):
+            try:
+                lambda_function.calling_vendor('test-failures', lambda: raising(error))
+            except Exception:
+                pass
+        assert limiter['limit'] == 4
+        assert limiter['failed'] == 4
+
+        assert lambda_function.calling_vendor('test-failures', lambda: 'ok') == 'ok'
+        assert limiter['limit'] == 4.25
+    finally:
+        removing_vendor('test-failures')
+
+def test_token_bucket_paces_calls():
+    limiter = installing_vendor('test-bucket', {'rate': 50, 'concurrency': 32})
+    try:
+        call_start = time.time()
+        # The bucket starts full, so 50 calls burst and the next 25 wait for tokens at 50/s
+        for _ in range(75):
+            calling('test-bucket', 'success')
+        elapsed = time.time() - call_start
+    finally:
+        removing_vendor('test-bucket')
+    print(f'elapsed: {elapsed:.3f}s, waited: {limiter["wait_seconds"]:.3f}s')
+    assert 0.45 <= elapsed < 1.5
+    assert limiter['wait_seconds'] >= 0.4
+
+def test_vendor_metrics():
+    emitted = []
+    installing_vendor('test-metrics', {'rate': 1000, 'concurrency': 4})
+    try:
+        with patch.object(lambda_function, 'metrics_sink', emitted.append):
+            calling('test-metrics', 'success')
+            calling('test-metrics', 'throttled')
+            lambda_function.emitting_vendor_metrics()
+            lambda_function.emitting_vendor_metrics()
+    finally:
+        removing_vendor('test-metrics')
+
+    records = [json.loads(line) for line in emitted]
+    records = [record for record in records if record.get('Vendor') == 'test-metrics']
+    print(f'records: {records}')
+    assert len(records) == 2
+    assert records[0]['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Vendor']]
+    assert (records[0]['VendorCalls'], records[0]['VendorThrottled'], records[0]['VendorConcurrencyLimit']) == (2, 1, 2.12)
+    # Counts are per emit, the limit is a current value
+    assert (records[1]['VendorCalls'], records[1]['VendorThrottled'], records[1]['VendorConcurrencyLimit']) == (0, 0, 2.12)
+
+if __name__ == '__main__':
+    test_aimd_halves_once_per_cooldown_and_regrows()
+    test_failures_never_grow_the_limit()
+    test_token_bucket_paces_calls()
+    test_vendor_metrics()
+    print(f'Vendor limit checks passed!')
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+class StubEmbeddings:
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+class StubIndex:
+    # Any upsert chunk holding a vector ID that starts with 'bad' fails as a whole
+    def __init__(self):
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def upsert(self, vectors):
+        vector_ids = [vector_id for vector_id, _, _ in vectors]
+        with self.lock:
+            self.chunks.append(vector_ids)
+        if any(vector_id.startswith('bad') for vector_id in vector_ids):
+            raise RuntimeError('upsert failed')
+
+def buffering(test):
+    embeddings, index = StubEmbeddings(), StubIndex()
+    settings = {'VECTOR_BUFFER_SIZE': 4, 'VECTOR_BUFFER_MAX_AGE': 30.0, 'PINECONE_UPSERT_BATCH_SIZE': 100, 'RESULT_CACHE_ENABLED': False}
+    with patch.multiple(lambda_function, **settings), patch.dict(lambda_function.client_cache, embeddings_model=embeddings, pinecone_index=index):
+        try:
+            test(embeddings, index)
+        finally:
+            lambda_function.flushing_vector_buffer()
+    assert lambda_function.vector_buffer == []
+    assert lambda_function.vector_buffer_producers == 0
+
+def test_size_triggered_flush():
+    def test(embeddings, index):
+        producers = [lambda_function.registering_vector_producer() for _ in range(5)]
+        futures = [lambda_function.buffering_vector(f'text {n}', {}, f'vector-{n}', producers[n]) for n in range(3)]
+        assert not any(future.done() for future in futures)
+        # The fourth item fills the buffer while one producer is still running
+        futures.append(lambda_function.buffering_vector('text 3', {}, 'vector-3', producers[3]))
+        assert [future.result(timeout=0) for future in futures] == ['vector-0', 'vector-1', 'vector-2', 'vector-3']
+        assert index.chunks == [['vector-0', 'vector-1', 'vector-2', 'vector-3']]
+        assert len(embeddings.batches) == 1
+        lambda_function.finishing_vector_producer(producers[4])
+    buffering(test)
+
+def test_last_producer_flush():
+    def test(embeddings, index):
+        producers = [lambda_function.registering_vector_producer() for _ in range(2)]
+        first = lambda_function.buffering_vector('first', {}, 'vector-first', producers[0])
+        assert not first.done()
+        # No record left that could add to the buffer, so it flushes without waiting for the age limit
+        second = lambda_function.buffering_vector('second', {}, 'vector-second', producers[1])
+        assert first.result(timeout=0) == 'vector-first'
+        assert second.result(timeout=0) == 'vector-second'
+        assert index.chunks == [['vector-first', 'vector-second']]
+    buffering(test)
+
+def test_age_triggered_flush():
+    def test(embeddings, index):
+        lambda_function.VECTOR_BUFFER_MAX_AGE = 0.2
+        producers = [lambda_function.registering_vector_producer() for _ in range(2)]
+        buffered_at = time.time()
+        future = lambda_function.buffering_vector('lonely', {}, 'vector-lonely', producers[0])
+        # The other producer never adds anything, the background flusher picks the item up once it is old enough
+        assert future.result(timeout=5) == 'vector-lonely'
+        elapsed = time.time() - buffered_at
+        print(f'age flush after {elapsed:.3f}s')
+        assert 0.15 <= elapsed < 2
+        lambda_function.finishing_vector_producer(producers[1])
+    buffering(test)
+
+def test_failed_chunk_only_fails_its_records():
+    def test(embeddings, index):
+        lambda_function.PINECONE_UPSERT_BATCH_SIZE = 2
+        producers = [lambda_function.registering_vector_producer() for _ in range(4)]
+        vector_ids = ['good-0', 'good-1', 'bad-2', 'good-3']
+        futures = [lambda_function.buffering_vector(vector_id, {}, vector_id, producer) for vector_id, producer in zip(vector_ids, producers)]
+        assert index.chunks == [['good-0', 'good-1'], ['bad-2', 'good-3']]
+        assert futures[0].result(timeout=0) == 'good-0'
+        assert futures[1].result(timeout=0) == 'good-1'
+        for future in futures[2:]:
+            assert isinstance(future.exception(timeout=0), RuntimeError)
+    buffering(test)
+
+if __name__ == '__main__':
+    test_size_triggered_flush()
+    test_last_producer_flush()
+    test_age_triggered_flush()
+    test_failed_chunk_only_fails_its_records()
+    print(f'Vector buffer checks passed!')
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+def s3_record(key):
+    return {
+        's3': {
+            'bucket': {'name': 'mia-audiofiles'},
+            'object': {'key': key, 'eTag': f'etag-{key}'}
+        }
+    }
+
+def sqs_message(message_id, body):
+    return {'messageId': message_id, 'body': body if isinstance(body, str) else json.dumps(body)}
+
+def stubbing_pipeline(failing_keys=()):
+    # Every record succeeds except the keys whose transcription is armed to fail
+    processed = []
+    processed_lock = threading.Lock()
+
+    def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
+        return {}, initial_object_key, None, {'saveaudiofiles': 'true'}, None
+    def transcribing_audio(bucket_name, final_object_key, *args, **kwargs):
+        if final_object_key in failing_keys:
+            raise RuntimeError('transcription failed')
+        with processed_lock:
+            processed.append(final_object_key)
+        return 'null'
+
+    lambda_function.ledger.clear()
+    return processed, patch.multiple(
+        lambda_function,
+        downloading_s3_objects=downloading_s3_objects,
+        transcribing_audio=transcribing_audio,
+        delete_or_not_audio_file=lambda *args: None,
+    )
+
+def test_batch_item_failures():
+    event = {
+        'Records': [
+            sqs_message('ok', {'Records': [s3_record('recordings/a.m4a'), s3_record('recordings/b.m4a')]}),
+            sqs_message('partial', {'Records': [s3_record('recordings/c.m4a'), s3_record('recordings/d.m4a')]}),
+            sqs_message('malformed', 'not json'),
+            sqs_message('test-event', {'Service': 'Amazon S3', 'Event': 's3:TestEvent', 'Bucket': 'mia-audiofiles'}),
+        ]
+    }
+    processed, stubs = stubbing_pipeline(failing_keys=('recordings/d.m4a',))
+    with stubs:
+        response = lambda_function.sqs_handler(event, None)
+    print(f'response: {response}, processed: {processed}')
+
+    assert sorted(item['itemIdentifier'] for item in response['batchItemFailures']) == ['malformed', 'partial']
+    assert sorted(processed) == ['recordings/a.m4a', 'recordings/b.m4a', 'recordings/c.m4a']
+
+def test_empty_batch():
+    processed, stubs = stubbing_pipeline()
+    with stubs:
+        response = lambda_function.sqs_handler({'Records': []}, None)
+    assert response == {'batchItemFailures': []}
+    assert processed == []
+
+def test_multi_record_handler():
+    keys = [f'recordings/multi_{n}.m4a' for n in range(5)]
+    processed, stubs = stubbing_pipeline(failing_keys=(keys[3],))
+    with stubs:
+        response = lambda_function.handler({'Records': [s3_record(key) for key in keys]}, None)
+    body = json.loads(response['body'])
+    print(f'body: {body}')
+
+    assert response['statusCode'] == 400
+    assert body['succeeded'] == 4
+    assert body['failed'] == 1
+    assert [result['key'] for result in body['results']] == keys
+    assert [result['status'] for result in body['results']] == ['success', 'success', 'success', 'failure', 'success']
+    assert sorted(processed) == sorted(keys[:3] + keys[4:])
+
+if __name__ == '__main__':
+    test_batch_item_failures()
+    test_empty_batch()
+    test_multi_record_handler()
+    print(f'SQS checks passed!')
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+REPLAYS = 8
+
+test_event = {
+    'Records': [
+        {
+            's3': {
+                'bucket': {'name': 'mia-audiofiles'},
+                'object': {'key': 'recordings/recording_206419037.m4a', 'eTag': 'd41d8cd98f00b204e9800998ecf8427e'}
+            }
+        }
+    ]
+}
+
+def stub_pipeline():
+    # Replace every S3/STT/LLM/vector call with a counter
+    calls = []
+    calls_lock = threading.Lock()
+
+    def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
+        return {}, initial_object_key, None, {'saveaudiofiles': 'true'}, None
+    def transcribing_audio(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata, cleaned_audio_bytes=None, metrics=None):
+        time.sleep(0.2)
+        with calls_lock:
+            calls.append(final_object_key)
+        return 'null'
+    def delete_or_not_audio_file(bucket_name, final_object_key, audiofile_metadata):
+        pass
+
+    return calls, patch.multiple(
+        lambda_function,
+        downloading_s3_objects=downloading_s3_objects,
+        transcribing_audio=transcribing_audio,
+        delete_or_not_audio_file=delete_or_not_audio_file,
+    )
+
+def replaying_concurrently():
+    calls, stubs = stub_pipeline()
+    with stubs, ThreadPoolExecutor(max_workers=REPLAYS) as executor:
+        responses = list(executor.map(lambda _: lambda_function.handler(json.loads(json.dumps(test_event)), None), range(REPLAYS)))
+
+    statuses = [json.loads(response['body'])['results'][0]['status'] for response in responses]
+    print(f'statuses: {statuses}')
+    print(f'calls: {calls}')
+    return calls, statuses
+
+def test_in_memory_ledger():
+    lambda_function.ledger.clear()
+    calls, statuses = replaying_concurrently()
+    assert len(calls) == 1
+    assert statuses.count('success') == 1
+    assert statuses.count('duplicate') == REPLAYS - 1
+
+def test_file_ledger():
+    with tempfile.TemporaryDirectory() as ledger_dir:
+        with patch.object(lambda_function, 'LEDGER_DIR', ledger_dir):
+            calls, statuses = replaying_concurrently()
+    assert len(calls) == 1
+    assert statuses.count('success') == 1
+
+def test_deterministic_vector_id():
+    record = test_event['Records'][0]
+    key = lambda_function.vector_key(record, 'mia-audiofiles', record['s3']['object']['key'])
+    assert lambda_function.deterministic_vector_id(key) == lambda_function.deterministic_vector_id(key)
+
+    # A versioned notification and a backfill listing of the same object map onto the same vector
+    versioned = {'s3': {'bucket': {'name': 'mia-audiofiles'}, 'object': dict(record['s3']['object'], versionId='3HL4kqtJlcpXroDTDmJ')}}
+    listed = {'s3': {'bucket': {'name': 'mia-audiofiles'}, 'object': {'key': record['s3']['object']['key'], 'eTag': f'"{record["s3"]["object"]["eTag"]}"'}}}
+    assert lambda_function.vector_key(versioned, 'mia-audiofiles', record['s3']['object']['key']) == key
+    assert lambda_function.vector_key(listed, 'mia-audiofiles', record['s3']['object']['key']) == key
+    assert lambda_function.ledger_key(versioned, 'mia-audiofiles', record['s3']['object']['key']) != lambda_function.ledger_key(record, 'mia-audiofiles', record['s3']['object']['key'])
+
+def test_failed_record_keeps_audio():
+    deleted = []
+    lambda_function.ledger.clear()
+    with patch.multiple(
+        lambda_function,
+        downloading_s3_objects=lambda event, bucket_name, initial_object_key, remote_cleaning=True: ({}, initial_object_key, None, {'saveaudiofiles': 'false'}, None),
+        transcribing_audio=lambda *args, **kwargs: 'hello there friend',
+        finalizing_transcript=lambda raw_transcript: 1 / 0,
+        delete_or_not_audio_file=lambda bucket_name, final_object_key, audiofile_metadata: deleted.append(final_object_key),
+    ):
+        response = lambda_function.handler(json.loads(json.dumps(test_event)), None)
+    assert json.loads(response['body'])['results'][0]['status'] == 'failure'
+    assert deleted == []
+
+if __name__ == '__main__':
+    test_in_memory_ledger()
+    test_file_ledger()
+    test_deterministic_vector_id()
+    test_failed_record_keeps_audio()
+    print(f'Idempotency checks passed!')
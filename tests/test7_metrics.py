@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+test_event = {
+    'Records': [
+        {
+            's3': {
+                'bucket': {'name': 'mia-audiofiles'},
+                'object': {'key': 'recordings/recording_metrics.wav', 'eTag': '0cc175b9c0f1b6a831c399e269772661'}
+            }
+        }
+    ]
+}
+
+def capturing_metrics():
+    # Stub every external call and collect the EMF lines instead of printing them
+    emitted = []
+
+    def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
+        return {'ContentLength': 320044}, initial_object_key, None, {'saveaudiofiles': 'true'}, None
+    def transcribing_audio(bucket_name, final_object_key, audiofile_s3obj, audiofile_download_path, audiofile_metadata, cleaned_audio_bytes=None, metrics=None):
+        metrics['AudioSeconds'] = 10.0
+        return 'null'
+    def delete_or_not_audio_file(bucket_name, final_object_key, audiofile_metadata):
+        pass
+
+    lambda_function.ledger.clear()
+    with patch.multiple(
+        lambda_function,
+        downloading_s3_objects=downloading_s3_objects,
+        transcribing_audio=transcribing_audio,
+        delete_or_not_audio_file=delete_or_not_audio_file,
+        metrics_sink=emitted.append,
+    ):
+        response = lambda_function.handler(json.loads(json.dumps(test_event)), None)
+
+    print(f'response: {response}')
+    return [json.loads(line) for line in emitted]
+
+def test_record_metrics():
+    records = capturing_metrics()
+    record_metrics = [record for record in records if record.get('Key') == 'recordings/recording_metrics.wav']
+    assert len(record_metrics) == 1
+    record = record_metrics[0]
+    print(f'record: {record}')
+
+    assert record['Status'] == 'success'
+    assert record['AudioBytes'] == 320044
+    assert record['AudioSeconds'] == 10.0
+    for stage in ('audio', 'metadata', 'transcript', 'delete', 'final_transcript', 'upsert'):
+        assert f'{stage}Duration' in record
+
+    # Every metric value must be declared in the EMF directive
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    declared = {metric['Name'] for metric in directive['Metrics']}
+    assert 'transcriptDuration' in declared and 'TotalDuration' in declared
+    assert 'Key' not in declared
+
+def test_invocation_metrics():
+    records = capturing_metrics()
+    invocation_metrics = [record for record in records if record.get('EntryPoint') == 'handler']
+    assert len(invocation_metrics) == 1
+    record = invocation_metrics[0]
+    print(f'invocation: {record}')
+
+    assert record['Records'] == 1 and record['Failures'] == 0
+    assert record['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['EntryPoint']]
+
+if __name__ == '__main__':
+    test_record_metrics()
+    test_invocation_metrics()
+    print(f'Metrics checks passed!')
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+backfill_event = {
+    'mode': 'vectors',
+    'name': 'test-backfill',
+    'start_date': '2024-03-01',
+    'end_date': '2024-03-03',
+}
+
+class StubEmbeddings:
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+class StubIndex:
+    # Two vectors per day, one upsert failure can be armed to interrupt a run
+    def __init__(self):
+        self.vectors = {}
+        for day in (1, 2, 3):
+            for n in range(2):
+                metadata = {'text': f'march {day} note {n}', 'year': 2024, 'month': 3, 'day': day, 'hours': 9, 'currenttimeformattedstring': f'2024-03-0{day} 09:00:00'}
+                self.vectors[f'vector-{day}-{n}'] = metadata
+        self.upserts = []
+        self.fail_next_upsert = False
+        self.lock = threading.Lock()
+
+    def query(self, vector, filter, top_k):
+        matches = [
+            SimpleNamespace(id=vector_id)
+            for vector_id, metadata in self.vectors.items()
+            if all(metadata.get(field) == condition['$eq'] for field, condition in filter.items())
+        ]
+        return {'matches': matches[:top_k]}
+
+    def fetch(self, ids):
+        return {'vectors': {vector_id: SimpleNamespace(id=vector_id, metadata=dict(self.vectors[vector_id])) for vector_id in ids}}
+
+    def upsert(self, vectors):
+        with self.lock:
+            if self.fail_next_upsert:
+                self.fail_next_upsert = False
+                raise RuntimeError('upsert failed')
+            self.upserts.extend(vector_id for vector_id, _, _ in vectors)
+
+def installing_stubs():
+    embeddings, index = StubEmbeddings(), StubIndex()
+    return embeddings, index, patch.dict(lambda_function.client_cache, embeddings_model=embeddings, pinecone_index=index)
+
+def test_backfill_resumes_from_checkpoint():
+    _, index, stubs = installing_stubs()
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        with stubs, patch.multiple(lambda_function, BACKFILL_MAX_WORKERS=1, BACKFILL_CHECKPOINT_DIR=checkpoint_dir):
+            index.fail_next_upsert = True
+            first = json.loads(lambda_function.backfill_handler(dict(backfill_event), None)['body'])
+            print(f'first run: {first}')
+            assert not first['complete']
+            assert len(index.upserts) == 4
+
+            second = json.loads(lambda_function.backfill_handler(dict(backfill_event), None)['body'])
+            print(f'second run: {second}')
+            assert second['complete']
+            assert second['processed'] == 2
+            assert sorted(set(index.upserts)) == sorted(index.vectors)
+
+            with open(os.path.join(checkpoint_dir, 'test-backfill.json'), 'r', encoding='utf-8') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            assert sorted(checkpoint['completed']) == ['2024-03-01', '2024-03-02', '2024-03-03']
+
+            third = json.loads(lambda_function.backfill_handler(dict(backfill_event), None)['body'])
+            assert third['processed'] == 0
+
+def test_backfill_splits_saturated_days():
+    _, index, stubs = installing_stubs()
+    with stubs, patch.object(lambda_function, 'BACKFILL_QUERY_TOP_K', 2):
+        vector_ids = lambda_function.listing_partition_vector_ids({'year': 2024, 'month': 3, 'day': 1})
+    assert sorted(vector_ids) == ['vector-1-0', 'vector-1-1']
+
+def test_reindexing_skips_cleaning_lambda_and_deletion():
+    calls = []
+    def downloading_s3_objects(event, bucket_name, initial_object_key, remote_cleaning=True):
+        audiofile_metadata = {'cleanaudio': 'true', 'filtermusic': 'false', 'normalizeloudness': 'false', 'removesilence': 'false', 'saveaudiofiles': 'false'}
+        final_object_key, cleaned_audio_bytes = lambda_function.clean_or_not_final_audio_path(event, bucket_name, initial_object_key, {'ContentLength': 14}, audiofile_metadata, remote_cleaning)
+        return {}, final_object_key, None, audiofile_metadata, cleaned_audio_bytes
+    def invoke(**kwargs):
+        calls.append('invoke')
+        raise RuntimeError('cleaning Lambda unavailable')
+    stubs = patch.multiple(
+        lambda_function,
+        AUDIO_CLEANING_LAMBDA_NAME='audio-cleaning',
+        downloading_s3_objects=downloading_s3_objects,
+        peeking_audio_header=lambda bucket_name, object_key, download_path: b'\x00\x00\x00\x20ftypM4A ',
+        get_lambda=lambda: SimpleNamespace(invoke=invoke),
+        transcribing_audio=lambda *args, **kwargs: 'null',
+        deleting_original_audio_file=lambda *args: calls.append('delete_original'),
+        delete_or_not_audio_file=lambda *args: calls.append('delete'),
+    )
+    record = {'s3': {'bucket': {'name': 'mia-audiofiles'}, 'object': {'key': 'recordings/recording_1.m4a'}}}
+    with stubs:
+        results = lambda_function.process_records({'Records': [record]}, [(record, 'mia-audiofiles', 'recordings/recording_1.m4a')], reindexing=True)
+        print(f'reindexing: {results}, calls: {calls}')
+        assert results[0]['status'] == 'success'
+        assert calls == []
+
+        lambda_function.ledger.clear()
+        results = lambda_function.process_records({'Records': [record]}, [(record, 'mia-audiofiles', 'recordings/recording_1.m4a')])
+        print(f'processing: {results}, calls: {calls}')
+        assert results[0]['status'] == 'failure'
+        assert calls == ['invoke']
+    lambda_function.ledger.clear()
+
+class StubListingS3:
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys, StartAfter=''):
+        keys = [key for key in self.keys if key.startswith(Prefix) and key > StartAfter][:MaxKeys]
+        return {'Contents': [{'Key': key, 'ETag': f'"etag-{key}"'} for key in keys]}
+
+def test_audio_backfill_retries_failed_objects():
+    keys = [f'recordings/recording_{n}.m4a' for n in range(5)]
+    failing = {'recordings/recording_1.m4a'}
+    attempts = []
+    def process_record(event, record, bucket_name, initial_object_key, reindexing=False):
+        assert reindexing
+        attempts.append(initial_object_key)
+        if initial_object_key in failing:
+            raise RuntimeError('transcription failed')
+        return 'success'
+
+    audio_event = {'mode': 's3', 'name': 'test-audio-backfill', 'bucket': 'mia-audiofiles', 'prefix': 'recordings/'}
+    s3 = StubListingS3(keys)
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        with patch.multiple(lambda_function, BACKFILL_PAGE_SIZE=2, BACKFILL_CHECKPOINT_DIR=checkpoint_dir, get_s3=lambda: s3, process_record=process_record):
+            first = json.loads(lambda_function.backfill_handler(dict(audio_event), None)['body'])
+            print(f'first run: {first}')
+            assert not first['complete']
+            assert (first['processed'], first['failed']) == (5, 1)
+
+            # Still failing, so the resume retries it and stays incomplete
+            attempts.clear()
+            second = json.loads(lambda_function.backfill_handler(dict(audio_event), None)['body'])
+            assert attempts == ['recordings/recording_1.m4a']
+            assert not second['complete']
+
+            failing.clear()
+            attempts.clear()
+            third = json.loads(lambda_function.backfill_handler(dict(audio_event), None)['body'])
+            print(f'third run: {third}')
+            assert attempts == ['recordings/recording_1.m4a']
+            assert third['complete']
+
+if __name__ == '__main__':
+    test_backfill_resumes_from_checkpoint()
+    test_backfill_splits_saturated_days()
+    test_reindexing_skips_cleaning_lambda_and_deletion()
+    test_audio_backfill_retries_failed_objects()
+    print(f'Backfill checks passed!')
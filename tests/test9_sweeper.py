@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import lambda_function
+
+sweep_event = {
+    'start_date': '2024-03-01',
+    'end_date': '2024-03-02',
+}
+
+class StubIndex:
+    def __init__(self):
+        self.vectors = {
+            'null-dated': {'text': 'null', 'year': 2024, 'month': 3, 'day': 1},
+            'null-undated': {'text': ' null'},
+            'short': {'text': 'ok then', 'year': 2024, 'month': 3, 'day': 1},
+            'original': {'text': 'Picked up the groceries on the way home', 'username': 'nik', 'currenttimeformattedstring': '2024-03-01 09:00:00', 'year': 2024, 'month': 3, 'day': 1},
+            'copy': {'text': 'picked up the groceries  on the way home', 'username': 'nik', 'currenttimeformattedstring': '2024-03-02 10:00:00', 'year': 2024, 'month': 3, 'day': 2},
+            'other-user': {'text': 'Picked up the groceries on the way home', 'username': 'sam', 'currenttimeformattedstring': '2024-03-02 11:00:00', 'year': 2024, 'month': 3, 'day': 2},
+        }
+        self.deletes = []
+        self.lock = threading.Lock()
+
+    def query(self, vector, filter, top_k):
+        def matching(metadata):
+            for field, condition in filter.items():
+                if '$in' in condition and metadata.get(field) not in condition['$in']:
+                    return False
+                if '$eq' in condition and metadata.get(field) != condition['$eq']:
+                    return False
+            return True
+        return {'matches': [SimpleNamespace(id=vector_id) for vector_id, metadata in self.vectors.items() if matching(metadata)][:top_k]}
+
+    def fetch(self, ids):
+        return {'vectors': {vector_id: SimpleNamespace(id=vector_id, metadata=dict(self.vectors[vector_id])) for vector_id in ids}}
+
+    def delete(self, ids):
+        with self.lock:
+            self.deletes.append(list(ids))
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+
+def sweeping(dry_run):
+    index = StubIndex()
+    lambda_function.client_cache['pinecone_index'] = index
+    try:
+        response = lambda_function.sweeper_handler(dict(sweep_event, dry_run=dry_run), None)
+    finally:
+        lambda_function.client_cache.pop('pinecone_index', None)
+    stats = json.loads(response['body'])
+    print(f'stats: {stats}')
+    return index, stats
+
+def test_dry_run_deletes_nothing():
+    index, stats = sweeping(True)
+    assert index.deletes == []
+    assert (stats['junk'], stats['short'], stats['duplicates']) == (2, 1, 1)
+    assert stats['deleted'] == 0
+
+def test_sweep_keeps_earliest_copy():
+    with patch.object(lambda_function, 'SWEEP_DELETE_BATCH_SIZE', 1):
+        index, stats = sweeping(False)
+    assert sorted(index.vectors) == ['original', 'other-user']
+    assert stats['deleted'] == 4
+    assert all(len(batch) == 1 for batch in index.deletes)
+
+if __name__ == '__main__':
+    test_dry_run_deletes_nothing()
+    test_sweep_keeps_earliest_copy()
+    print(f'Sweeper checks passed!')